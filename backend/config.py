@@ -11,7 +11,7 @@ FRONTEND_ORIGINS = [
 ]
 
 # 本地图片根目录
-IMAGE_ROOT = os.getenv("IMAGE_ROOT")
+IMAGE_ROOT = os.getenv("IMAGE_ROOT", "C:/productImage")
 
 # MongoDB URI
 MONGO_URI = os.getenv("MONGO_URI")
@@ -19,4 +19,75 @@ MONGO_URI = os.getenv("MONGO_URI")
 # 图片上传的根目录，示例：C:/productImage
 UPLOAD_BASE = os.getenv("UPLOAD_BASE", r"C:\productImage")
 
-SESSION_CONFIG_PATH = os.getenv("SESSION_CONFIG_PATH", "config/session.txt")
\ No newline at end of file
+SESSION_CONFIG_PATH = os.getenv("SESSION_CONFIG_PATH", "config/session.txt")
+
+# MongoDB 数据库名
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "QCsys")
+
+# 每个 worker 进程的连接池上限；多 worker 部署时总连接数 = workers * 该值
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+
+# 选主/建连超时（毫秒），决定启动检查和 /readyz 最长等待时间
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# 统计/导出使用的分析连接（读从节点）。不配置 URI 时复用 MONGO_URI
+MONGO_ANALYTICS_URI = os.getenv("MONGO_ANALYTICS_URI", "")
+MONGO_ANALYTICS_MAX_POOL_SIZE = int(os.getenv("MONGO_ANALYTICS_MAX_POOL_SIZE", "10"))
+# MongoDB 要求 maxStalenessSeconds >= 90
+MONGO_ANALYTICS_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", "120"))
+# 聚合查询的 socket 超时（毫秒），避免慢统计长期占用连接
+MONGO_ANALYTICS_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_ANALYTICS_SOCKET_TIMEOUT_MS", "30000"))
+
+# 标题/描述草稿生成：后端名称或 "module:factory" 导入路径（默认本地确定性实现）、批大小、攒批等待时间、缓存条数、预生成条数
+AI_GENERATOR_BACKEND = os.getenv("AI_GENERATOR_BACKEND", "local")
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "8"))
+AI_BATCH_WAIT_MS = int(os.getenv("AI_BATCH_WAIT_MS", "50"))
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2000"))
+AI_PREFETCH_COUNT = int(os.getenv("AI_PREFETCH_COUNT", "3"))
+
+# 描述模板目录的重新加载周期（秒）
+TEMPLATE_REFRESH_SECONDS = int(os.getenv("TEMPLATE_REFRESH_SECONDS", "60"))
+
+# 记录生命周期事件日志：批量写入间隔（毫秒）、保留天数、缓冲区上限
+EVENT_FLUSH_INTERVAL_MS = int(os.getenv("EVENT_FLUSH_INTERVAL_MS", "300"))
+EVENT_TTL_DAYS = int(os.getenv("EVENT_TTL_DAYS", "180"))
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "50000"))
+
+# 记录锁超时时间（秒），超过该时间锁定自动过期
+LOCK_TIMEOUT_SECONDS = int(os.getenv("LOCK_TIMEOUT_SECONDS", "300"))
+# 续租批量写回间隔（秒），必须远小于 LOCK_TIMEOUT_SECONDS（最大取其 1/4）
+LEASE_FLUSH_INTERVAL_SECONDS = float(os.getenv("LEASE_FLUSH_INTERVAL_SECONDS", "15"))
+
+# 图片存储：local（IMAGE_ROOT / UPLOAD_BASE 本地目录）或 s3（S3 兼容存储，如 MinIO）
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "local")
+# 图片 I/O 线程池大小
+IMAGE_IO_THREADS = int(os.getenv("IMAGE_IO_THREADS", "8"))
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")
+S3_BUCKET = os.getenv("S3_BUCKET", "product-images")
+S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.getenv("S3_SECRET_KEY", "")
+S3_REGION = os.getenv("S3_REGION", "")
+
+# 后台任务队列：每个进程的 worker 协程数、空闲轮询间隔（毫秒）、任务租约（秒）、
+# 线程池/进程池大小、已完成任务保留天数
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "2"))
+TASK_POLL_INTERVAL_MS = int(os.getenv("TASK_POLL_INTERVAL_MS", "1000"))
+TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "60"))
+TASK_THREAD_POOL = int(os.getenv("TASK_THREAD_POOL", "4"))
+TASK_PROCESS_POOL = int(os.getenv("TASK_PROCESS_POOL", "2"))
+TASK_RETENTION_DAYS = int(os.getenv("TASK_RETENTION_DAYS", "7"))
+
+# 缩略图长边像素
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "400"))
+
+# 本地图片按内容去重：内容只存一份在 BLOB_ROOT，各路径为硬链接。
+# IMAGE_ROOT 和 UPLOAD_BASE 共用同一个 BLOB_ROOT，需在同一分区才能共享（否则退化为拷贝）。
+# BLOB_ROOT 不能放在 IMAGE_ROOT / UPLOAD_BASE 之内，否则会被静态图片路由公开访问；默认与 IMAGE_ROOT 同级
+IMAGE_DEDUP = os.getenv("IMAGE_DEDUP", "1") == "1"
+BLOB_ROOT = os.getenv("BLOB_ROOT", IMAGE_ROOT.rstrip("/\\") + ".blobs")
+
+# session 归档：每批搬移条数，以及图片冷存储导出目录
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_EXPORT_DIR = os.getenv("ARCHIVE_EXPORT_DIR", "archive")
+# 归档目录（session_archive）在各进程内的缓存时间（秒）；归档命令搬移前会等待同样时长
+ARCHIVE_CATALOG_REFRESH_SECONDS = int(os.getenv("ARCHIVE_CATALOG_REFRESH_SECONDS", "10"))
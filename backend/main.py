@@ -1,55 +1,121 @@
 # backend/main.py
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from routes import qc
-from routes import auth
-from routes import record
-from routes.record import router as record_router
-from fastapi.staticfiles import StaticFiles
-from config import UPLOAD_BASE, FRONTEND_ORIGINS
-# from routes import users
+from starlette.concurrency import run_in_threadpool
+
+# 载入配置
+from config import IMAGE_ROOT, UPLOAD_BASE, FRONTEND_ORIGINS, IMAGE_STORAGE
+from routes import auth, qc, record
 from routes import stats  # Import the stats module
-# Make sure to import UPLOAD_BASE from your config or define it appropriately
-from config import UPLOAD_BASE
-import os
+from routes import templates
+from routes import images
+from routes import download
+# from routes import users
+from services.db import connect_db, close_db, ping_db, ensure_indexes
+from services.ai_generator import generator
+from services.event_log import event_log
+from services.lease_tracker import lease_tracker
+from services.task_queue import task_queue
+import services.jobs  # noqa: F401  注册后台任务
 
-app = FastAPI()
+logger = logging.getLogger("uvicorn.error")
 
-# 载入配置
-from config import IMAGE_ROOT, FRONTEND_ORIGINS
-
-
-# 配置 CORS：允许前端地址访问
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=FRONTEND_ORIGINS or ["http://192.168.0.228:5174"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-# 注册路由
-app.include_router(auth.router, prefix="/api")
-app.include_router(record.router, prefix="/api/record")
-app.include_router(qc.router, prefix="/api/qc")
-# app.include_router(users.router, prefix="/api/users")
-app.include_router(stats.router, prefix="/api/stats")
-# 静态文件（本地图片目录）
-app.mount(
-    "/api/images",
-    StaticFiles(directory=IMAGE_ROOT),
-    name="api-images"
-)
-app.mount(
-    "/images", 
-    StaticFiles(directory=IMAGE_ROOT), 
-    name="images"
-)
-
-
-app.mount("/qc-images", StaticFiles(directory=UPLOAD_BASE), name="qc-images")
-@app.get("/")
-def read_root():
-    return {"message": "Backend is running"}
-
-print("CORS origins:", FRONTEND_ORIGINS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    每个 worker 进程启动时执行（已在 fork 之后）：
+    - 打开本进程的 MongoDB 连接池并 ping 验证连通性，确保索引存在
+    - 启动草稿生成的批处理任务、事件日志和锁续租的批量写入任务、后台任务 worker
+    - 退出时依次停止后台任务、关闭连接池
+    连不上数据库时不阻止启动，/readyz 会返回 503，由负载均衡/运维判断。
+    """
+    logger.info("CORS origins: %s", FRONTEND_ORIGINS)
+    try:
+        await run_in_threadpool(connect_db)
+        logger.info("MongoDB 连接成功")
+        await run_in_threadpool(ensure_indexes)
+    except Exception:
+        logger.exception("MongoDB 连接失败，/readyz 将返回 503")
+    await generator.start()
+    await event_log.start()
+    await lease_tracker.start()
+    await task_queue.start()
+    try:
+        yield
+    finally:
+        await task_queue.stop()
+        await lease_tracker.stop()
+        await event_log.stop()
+        await generator.stop()
+        await run_in_threadpool(close_db)
+
+
+def create_app() -> FastAPI:
+    """
+    App 工厂。多 worker 部署：
+        uvicorn main:create_app --factory --host 0.0.0.0 --port 5100 --workers 4
+    """
+    app = FastAPI(lifespan=lifespan)
+
+    # 配置 CORS：允许前端地址访问
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=FRONTEND_ORIGINS or ["http://192.168.0.228:5174"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # 注册路由
+    app.include_router(auth.router, prefix="/api")
+    app.include_router(record.router, prefix="/api/record")
+    app.include_router(qc.router, prefix="/api/qc")
+    # app.include_router(users.router, prefix="/api/users")
+    app.include_router(stats.router, prefix="/api/stats")
+    app.include_router(templates.router, prefix="/api/templates")
+    app.include_router(download.router, prefix="/api/download")
+    if IMAGE_STORAGE == "local":
+        # 静态文件（本地图片目录）
+        app.mount(
+            "/api/images",
+            StaticFiles(directory=IMAGE_ROOT),
+            name="api-images"
+        )
+        app.mount(
+            "/images",
+            StaticFiles(directory=IMAGE_ROOT),
+            name="images"
+        )
+        app.mount("/qc-images", StaticFiles(directory=UPLOAD_BASE), name="qc-images")
+    else:
+        # 对象存储：通过存储接口流式返回图片
+        app.include_router(images.router, prefix="/api/images")
+        app.include_router(images.router, prefix="/images")
+        app.include_router(images.qc_router, prefix="/qc-images")
+
+    @app.get("/")
+    def read_root():
+        return {"message": "Backend is running"}
+
+    @app.get("/healthz")
+    def healthz():
+        """存活探针：进程能响应即可，不访问数据库"""
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    def readyz():
+        """就绪探针：数据库可用才算就绪"""
+        if not ping_db():
+            return JSONResponse(status_code=503, content={"status": "unavailable", "mongo": False})
+        return {"status": "ok", "mongo": True}
+
+    return app
+
+
+# 兼容原有启动方式：uvicorn main:app
+app = create_app()
@@ -21,7 +21,7 @@ from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
-from services.db import users_collection
+from services.db import get_users_collection
 
 router = APIRouter()
 
@@ -55,7 +55,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
         raise credentials_exc
     username = username.strip()
     # 再去数据库确认用户存在
-    user = users_collection.find_one({"username": username})
+    user = get_users_collection().find_one({"username": username})
     if user is None:
         raise credentials_exc
     return username
@@ -73,7 +73,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     if not ok and len(hashed_password) < 60 and plain_password == hashed_password:
         # 顺便把明文替换成哈希
         new_hash = pwd_context.hash(plain_password)
-        users_collection.update_one({"password": hashed_password},
+        get_users_collection().update_one({"password": hashed_password},
                                     {"$set": {"password": new_hash}})
         return True
     return False
@@ -104,7 +104,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()) -> TokenResponse:
     Clients must send a form with fields `username` and `password`.
     """
     # Look up the user by username
-    user = users_collection.find_one({"username": form_data.username})
+    user = get_users_collection().find_one({"username": form_data.username})
     if not user or "password" not in user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
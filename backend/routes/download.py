@@ -0,0 +1,117 @@
+# backend/routes/download.py
+
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from routes.record import list_record_images
+from services.image_handler import record_images, join_key
+from services.zip_stream import ZipEntry, ZipStream
+
+router = APIRouter()
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 头，返回闭区间 (start, end)；格式不支持时返回 None（按整包返回），
+    范围不可满足时抛 416。
+    """
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+    else:
+        # bytes=-N：最后 N 个字节
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=416, detail="请求范围无效", headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def _entries(session: str, number: str, prefix: str = "") -> List[ZipEntry]:
+    entries = []
+    for name in await list_record_images(session, number):
+        key = join_key(session, number, name)
+        size, mtime = await record_images.stat(key)
+        entries.append(ZipEntry(name=f"{prefix}{name}", key=key, size=size, mtime=mtime))
+    return entries
+
+
+def _disposition(filename: str) -> str:
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+# ===========================
+# 下载单条记录的图片（支持 Range 断点续传）
+# ===========================
+@router.get("/{session}/{number}")
+async def download_record_zip(session: str, number: str, request: Request):
+    """
+    将 {session}/{number} 下的图片打包成 ZIP 流式返回（STORED，不再压缩）
+    支持 Range / If-Range，断点续传时内容未变则返回 206
+    """
+    try:
+        entries = await _entries(session, number)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法路径")
+    if not entries:
+        raise HTTPException(status_code=404, detail="没有图片")
+    zs = ZipStream(record_images, entries)
+    etag = zs.etag()
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": _disposition(f"{session}-{number}.zip"),
+    }
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, zs.size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(zs.size)
+        return StreamingResponse(zs.stream(), media_type="application/zip", headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{zs.size}"
+    return StreamingResponse(
+        zs.stream(start, end), status_code=206, media_type="application/zip", headers=headers
+    )
+
+
+# ===========================
+# 下载整个 session 的图片（按编号分目录）
+# ===========================
+@router.get("/{session}")
+async def download_session_zip(session: str):
+    """
+    将 session 下所有编号的图片打包成一个 ZIP 流，压缩包内为 {number}/{文件名}
+    """
+    try:
+        numbers = sorted(await record_images.list_dirs(join_key(session)))
+        entries: List[ZipEntry] = []
+        for number in numbers:
+            entries.extend(await _entries(session, number, prefix=f"{number}/"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法路径")
+    if not entries:
+        raise HTTPException(status_code=404, detail="没有图片")
+    zs = ZipStream(record_images, entries)
+    headers = {
+        "Content-Length": str(zs.size),
+        "Content-Disposition": _disposition(f"{session}.zip"),
+    }
+    return StreamingResponse(zs.stream(), media_type="application/zip", headers=headers)
@@ -0,0 +1,39 @@
+# backend/routes/images.py
+"""
+IMAGE_STORAGE=s3 时代替 StaticFiles 提供图片访问（路径与本地挂载保持一致）：
+- /api/images/{session}/{number}/{name}、/images/...：录货图片
+- /qc-images/...：质检图片
+"""
+import mimetypes
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from services.image_handler import ImageStorage, record_images, qc_images, join_key
+
+
+async def _serve(storage: ImageStorage, path: str) -> StreamingResponse:
+    try:
+        key = join_key(path)
+        size = await storage.size(key)
+        stream = await storage.open_stream(key)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="file not found")
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    return StreamingResponse(stream, media_type=media_type, headers={"Content-Length": str(size)})
+
+
+router = APIRouter()
+
+
+@router.get("/{path:path}")
+async def get_record_image(path: str):
+    return await _serve(record_images, path)
+
+
+qc_router = APIRouter()
+
+
+@qc_router.get("/{path:path}")
+async def get_qc_image(path: str):
+    return await _serve(qc_images, path)
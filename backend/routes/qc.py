@@ -4,16 +4,24 @@ from fastapi import APIRouter, Depends, HTTPException, Form, File, UploadFile, Q
 from fastapi.responses import JSONResponse
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, List, Optional
+import re
+import traceback
+
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
 
 from .auth import get_current_user
-from config import UPLOAD_BASE, SESSION_CONFIG_PATH
+from config import SESSION_CONFIG_PATH
 from services.db import get_collection
-
-# 使用 qa_bot 这个 collection 存 QC 信息
-qc_collection = get_collection("qa_bot")
+from services.image_handler import qc_images, join_key
+from services.archive import collections_for
 
 router = APIRouter(prefix="/api/qc", tags=["QC"])
 
+# 编号输入过程中的前缀查询最多返回条数
+LOOKUP_LIMIT = 10
+
 
 def get_current_session() -> str:
     """
@@ -26,6 +34,71 @@ def get_current_session() -> str:
         return ""
 
 
+def normalize_key(session: str, label: str, number: str) -> Dict[str, str]:
+    """(session, label, number) 的规范形式，与 qa_bot 唯一索引保持一致"""
+    return {
+        "session": session.strip(),
+        "label": label.strip().upper(),
+        "number": number.strip().upper(),
+    }
+
+
+def _done_number(number: str) -> Any:
+    """check_done.Number 是整数；纯数字编号按整数匹配"""
+    return int(number) if number.isdigit() else number
+
+
+def find_duplicate(key: Dict[str, str]) -> Optional[str]:
+    """
+    检查同一 session 的 label+number 是否已经录入过（check_done），
+    返回 "check_done" 或 None。查询只读索引（covered query），已归档的 session 查归档集合。
+    """
+    query = {"Session": key["session"], "Label": key["label"], "Number": _done_number(key["number"])}
+    for coll in collections_for("check_done", key["session"]):
+        if coll.find_one(query, {"_id": 0, "Session": 1, "Label": 1, "Number": 1}):
+            return "check_done"
+    return None
+
+
+@router.get("/lookup")
+def qc_lookup(
+    label: str = Query(...),
+    number: str = Query("", description="编号或编号前缀"),
+    session: Optional[str] = Query(None, description="默认当前 session"),
+):
+    """
+    QC 页面输入时调用：返回同一 session 中 label 相同、number 以输入开头的待录记录（qa_bot），
+    以及 number 完全一致的已录记录（check_done）。均为只读索引的查询；
+    旧 session 已归档时透明地查询归档集合。
+    """
+    key = normalize_key(session or get_current_session(), label, number)
+    query: Dict[str, Any] = {"session": key["session"], "label": key["label"]}
+    if key["number"]:
+        query["number"] = {"$regex": "^" + re.escape(key["number"])}
+    pending: List[Dict[str, Any]] = []
+    for coll in collections_for("qa_bot", key["session"]):
+        for p in (
+            coll.find(query, {"_id": 0, "session": 1, "label": 1, "number": 1})
+            .sort([("session", 1), ("label", 1), ("number", 1)])
+            .limit(LOOKUP_LIMIT)
+        ):
+            # 归档过程中同一文档可能同时出现在两边
+            if p not in pending:
+                pending.append(p)
+    pending = sorted(pending, key=lambda p: p["number"])[:LOOKUP_LIMIT]
+    done: List[Dict[str, Any]] = []
+    if key["number"]:
+        done_query = {"Session": key["session"], "Label": key["label"], "Number": _done_number(key["number"])}
+        for coll in collections_for("check_done", key["session"]):
+            for d in coll.find(done_query, {"_id": 0, "Session": 1, "Label": 1, "Number": 1}).limit(LOOKUP_LIMIT):
+                item = {"session": d["Session"], "label": d["Label"], "number": str(d["Number"])}
+                if item not in done:
+                    done.append(item)
+        done = done[:LOOKUP_LIMIT]
+    exists = any(p["number"] == key["number"] for p in pending) or bool(done)
+    return {"exists": exists, "pending": pending, "done": done}
+
+
 @router.post("/submit")
 async def qc_submit(
     label: str = Form(...),
@@ -41,12 +114,20 @@ async def qc_submit(
     if not session:
         raise HTTPException(status_code=400, detail="Current session 未配置")
 
-    # 2) 存 metadata 到 MongoDB
+    # 2) 存 metadata 到 MongoDB：已录入或已在队列中的重复编号直接报告，不再插入
+    key = normalize_key(session, label, number)
+    label, number = key["label"], key["number"]
+    # 先校验图片目录，非法编号不写入数据库
+    try:
+        folder = join_key(session, number)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法编号")
+    if await run_in_threadpool(find_duplicate, key):
+        raise HTTPException(status_code=409, detail=f"{label}{number} 已录入（check_done），请勿重复提交")
+
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
     doc = {
-        "session": session,
-        "label": label.upper(),
-        "number": number.upper(),
+        **key,
         "url": url,
         "note": note,
         "location": location,
@@ -54,30 +135,44 @@ async def qc_submit(
         "timestamp": timestamp,
         "locked": False,
     }
-    qc_collection.insert_one(doc)
-
-    # 3) 保存文件到磁盘
-    base_path = Path(UPLOAD_BASE) / session / number.upper()
-    base_path.mkdir(parents=True, exist_ok=True)
-
-    # 计算下一个文件序号
-    existing = [
-        f.stem.split("-")[-1]
-        for f in base_path.iterdir()
-        if f.is_file()
-    ]
-    used = [int(x) for x in existing if x.isdigit()]
-    next_idx = max(used + [0]) + 1
-
-    saved = 0
-    for f in files:
-        ext = Path(f.filename).suffix.lower()
-        dst = base_path / f"{number.upper()}-{next_idx}{ext}"
-        await f.write(dst)   # FastAPI >=0.95 支持 UploadFile.write()
-        saved += 1
-        next_idx += 1
+    # 使用 qa_bot 这个 collection 存 QC 信息；按唯一键 upsert，已存在时不覆盖
+    try:
+        res = await run_in_threadpool(
+            get_collection("qa_bot").update_one, key, {"$setOnInsert": doc}, upsert=True
+        )
+        duplicated = res.upserted_id is None
+    except DuplicateKeyError:
+        # 并发提交同一编号时，后到的 upsert 撞唯一索引
+        duplicated = True
+    if duplicated:
+        raise HTTPException(status_code=409, detail=f"{label}{number} 已在本批次待录队列中，请勿重复提交")
+
+    # 3) 保存文件到图片存储
+    saved: List[str] = []
+    try:
+        # 计算下一个文件序号
+        existing = [
+            Path(name).stem.split("-")[-1]
+            for name in await qc_images.list(folder)
+        ]
+        used = [int(x) for x in existing if x.isdigit()]
+        next_idx = max(used + [0]) + 1
+
+        for f in files:
+            ext = Path(f.filename).suffix.lower()
+            name = f"{folder}/{number}-{next_idx}{ext}"
+            await qc_images.put(name, f.file)
+            saved.append(name)
+            next_idx += 1
+    except Exception:
+        # 图片没存全：撤销本次写入的记录和图片，让 QC 可以重新提交，而不是留下没有图片的记录
+        traceback.print_exc()
+        for name in saved:
+            await qc_images.delete(name)
+        await run_in_threadpool(get_collection("qa_bot").delete_one, {"_id": res.upserted_id})
+        raise HTTPException(status_code=500, detail="保存图片失败，请重新提交")
 
-    return {"status": "ok", "saved": saved}
+    return {"status": "ok", "saved": len(saved)}
 
 
 @router.get("/images")
@@ -86,10 +181,10 @@ async def list_images(number: str = Query(...)):
     列出指定编号所有文件名。
     """
     session = get_current_session()
-    folder = Path(UPLOAD_BASE) / session / number.upper()
-    if not folder.exists():
+    try:
+        return await qc_images.list(join_key(session, number.upper()))
+    except ValueError:
         return []
-    return [f.name for f in folder.iterdir() if f.is_file()]
 
 
 @router.delete("/images")
@@ -102,9 +197,11 @@ async def delete_image(
     删除指定编号下的一张图片。
     """
     session = get_current_session()
-    path = Path(UPLOAD_BASE) / session / number.upper() / filename
-    if path.exists():
-        path.unlink()
+    try:
+        key = join_key(session, number.upper(), filename)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="file not found")
+    if await qc_images.delete(key):
         return JSONResponse(content="deleted", status_code=200)
     else:
         raise HTTPException(status_code=404, detail="file not found")
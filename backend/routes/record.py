@@ -1,26 +1,40 @@
 # backend/routes/record.py
 
-from fastapi import APIRouter, HTTPException, Query,Request
+from fastapi import APIRouter, HTTPException, Query,Request, BackgroundTasks
 from fastapi import UploadFile, File, Form
 from pydantic import BaseModel, Field
 from services.db import get_collection
+from services.ai_generator import generator, DraftInput
+from services.condition_templates import render_description
+from services.event_log import event_log
+from services.lease_tracker import lease_tracker
+from services.image_handler import record_images, join_key
+from services.task_queue import enqueue
+from services.archive import archived_sessions, collections_for
+from config import LOCK_TIMEOUT_SECONDS
 from bson import ObjectId
 from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from typing import Any, Dict, List, Optional
+import math
 import os
+import traceback
+import re
 
 
 
 router = APIRouter()
 
 
-# 本地存储图片根目录，可通过环境变量覆盖
-IMAGE_ROOT = os.getenv("IMAGE_ROOT", "C:/productImage")
+# 锁定超时时间 LOCK_TIMEOUT_SECONDS 见 config.py，超过该时间锁定自动过期
 
-# 废弃# 跳过锁定超时时间（秒），超过该时间锁定自动过期
-LOCK_TIMEOUT_SECONDS = 300
+# "下一条"软预留的有效期（秒）：期间其他人领取时优先跳过该记录，过期或无其他可领记录时失效
+RESERVE_TIMEOUT_SECONDS = LOCK_TIMEOUT_SECONDS
+
+# 支持的图片扩展名
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
 
 # --- Pydantic Models for input validation ---
 class SkipPayload(BaseModel):
@@ -82,6 +96,15 @@ class UnlockPayload(BaseModel):
     class Config:
         validate_by_name = True
 
+class DraftPayload(BaseModel):
+    """
+    生成标题/描述草稿的请求体
+    相同 (label, note, condition) 的请求命中缓存
+    """
+    label: str = Field(..., description="标签")
+    note: str = Field("", description="质检备注")
+    condition: str = Field("", description="成色")
+
 class UpdateUrlPayload(BaseModel):
     id: str = Field(..., alias="_id", description="要更新的记录ID")
     url: str = Field(..., alias="url", description="新 URL 地址")
@@ -94,25 +117,51 @@ def stringify_id(record: dict) -> dict:
     record["_id"] = str(record["_id"])
     return record
 
+_SUFFIX_RE = re.compile(r"-(\d+)(?=\.\w+$|$)")
+
+# 从文件名提取后缀数字（-1, -2...），与前端 extractSuffixNum 一致，没匹配到排到最后
+def extract_suffix_num(filename: str) -> float:
+    m = _SUFFIX_RE.search(filename)
+    return int(m.group(1)) if m else math.inf
+
+def _image_files(files: List[str]) -> List[str]:
+    return sorted(f for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTS)
+
+# 列出 {session}/{number} 下的图片文件名（按文件名排序）
+async def list_record_images(session: str, number: str) -> List[str]:
+    return _image_files(await record_images.list(join_key(session, number)))
+
+# 图片清单：按后缀数字排序的文件名 + 可直接拼接的访问前缀。
+# 阻塞调用，供 /next 这类已在线程池中运行的同步路由直接使用，不必切回事件循环再转到 IO 线程池
+def image_manifest(session: str, number: Any) -> Dict[str, Any]:
+    number = str(number)
+    files = _image_files(record_images.list_sync(join_key(session, number)))
+    return {"base": f"/api/images/{session}/{number}", "files": sorted(files, key=extract_suffix_num)}
+
 
 # ===========================
 # 获取所有可选的 session（批次）列表
 # ===========================
 @router.get("/sessions")
-def list_sessions():
+def list_sessions(include_archived: bool = Query(False, description="是否包含已归档的 session")):
     """
     返回 qa_bot 集合中所有不重复的 session 值，供前端下拉选择
     """
-    return get_collection("qa_bot").distinct("session")  # MongoDB distinct 获取不重复字段列表
+    sessions = get_collection("qa_bot").distinct("session")  # MongoDB distinct 获取不重复字段列表
+    if include_archived:
+        sessions = sorted(set(sessions) | set(archived_sessions()))
+    return sessions
 
 # ===========================
 # 获取当前 session 的状态：总数、锁定数、下一个锁定记录 
 # ===========================
 @router.get("/status")
 def session_status(session: Optional[str] = Query(None)):
-    coll = get_collection("qa_bot")
+    colls = collections_for("qa_bot", session)
+    coll = colls[0]
     base = {"session": session} if session else {}
-    total = coll.count_documents(base)
+    # 已归档的 session 没有锁，只统计残留条数
+    total = sum(c.count_documents(base) for c in colls)
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(seconds=LOCK_TIMEOUT_SECONDS)
     locked = coll.count_documents({**base, "locked": True, "lockedAt": {"$gte": cutoff}})
@@ -124,15 +173,61 @@ def session_status(session: Optional[str] = Query(None)):
                        "lockedAt": doc["lockedAt"].astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M")}
     return {"total": total, "locked": locked, "next_locked": next_locked}
 
+# 过滤条件：排除别人仍在有效期内的软预留
+def not_reserved_by_others(user: Optional[str], now: datetime) -> Dict[str, Any]:
+    reserve_cutoff = now - timedelta(seconds=RESERVE_TIMEOUT_SECONDS)
+    return {"$nor": [{
+        "reservedBy": {"$nin": [None, user]},
+        "reservedAt": {"$gte": reserve_cutoff},
+    }]}
+
+# 软预留当前用户的下一条记录，返回其 id 和图片清单；没有可预留记录时返回 None
+def reserve_up_next(base_filter: Dict[str, Any], current_id: str, user: str, now: datetime) -> Optional[Dict[str, Any]]:
+    coll = get_collection("qa_bot")
+    expired_cutoff = now - timedelta(seconds=LOCK_TIMEOUT_SECONDS)
+    nxt = coll.find_one_and_update(
+        {"$and": [
+            {**base_filter, "_id": {"$ne": ObjectId(current_id)}},
+            {"$or": [
+                {"locked": False},
+                {"locked": True, "lockedAt": {"$lt": expired_cutoff}},
+            ]},
+            not_reserved_by_others(user, now),
+        ]},
+        {"$set": {"reservedBy": user, "reservedAt": now}},
+        sort=[("skippedAt", 1), ("number", 1)],
+        projection={"session": 1, "label": 1, "number": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not nxt:
+        return None
+    return {
+        "_id": str(nxt["_id"]),
+        "session": nxt.get("session"),
+        "label": nxt.get("label"),
+        "number": nxt.get("number"),
+        "images": image_manifest(nxt.get("session", ""), nxt.get("number", "")),
+    }
+
 # ===========================
 # 获取下一条未锁定的记录，并加锁
 @router.get("/next")
-def get_next_record(session: Optional[str] = Query(None, description="Session ID to filter records"), user: Optional[str] = Query(None, description="Only fetch records for this user")):
+def get_next_record(
+    background_tasks: BackgroundTasks,
+    session: Optional[str] = Query(None, description="Session ID to filter records"),
+    user: Optional[str] = Query(None, description="Only fetch records for this user"),
+    include_images: bool = Query(False, description="同时返回本条记录的图片清单"),
+    prefetch: bool = Query(False, description="软预留下一条记录并返回其图片清单，便于前端预加载"),
+):
     """
     1. 过滤：指定 session（可选），且 doc.locked == False 或者锁已过期
     2. 原子操作 find_one_and_update：设置 locked=True, lockedAt=now
     3. 按 skippedAt, number 排序，优先返回最早跳过或最小编号
-    4. 格式化字段并返回
+    4. 格式化字段并返回；draft 为已预生成的标题/描述草稿（没有则为 null，不等待生成）
+    5. include_images=true 时附带 images: {base, files}，省去前端再请求 /images
+    6. prefetch=true 且传了 user 时，软预留下一条记录（reservedBy/reservedAt），
+       返回 upNext: {_id, session, label, number, images}；其他人领取时会优先绕开该记录
+    7. 响应后在后台为接下来几条记录预生成草稿
     """
 
 
@@ -153,19 +248,64 @@ def get_next_record(session: Optional[str] = Query(None, description="Session ID
             {"lockedBy": user}
         ]
     }
-    # 原子查找并更新锁定时间
-    doc = coll.find_one_and_update(
-        filter_query,
+    # 本人仍有效持有的锁（刷新页面、404 后重试）：重新返回同一条，不算新的领取
+    held_by_user = {"$and": [
+        {"$eq": ["$locked", True]},
+        {"$eq": ["$lockedBy", user]},
+        {"$gte": ["$lockedAt", expired_cutoff]},
+    ]}
+    claim_fields = {
+        "locked": True,
+        "lockedAt": now,
+        "lockedBy": user,
+    }
+    # 更新管道：claimedAt 为领取时间，用于统计录入耗时，续租和本人重新获取都不改变
+    claim_update = [
         {"$set": {
-            "locked": True,
-            "lockedAt": now,
-            "lockedBy": user
+            **{k: {"$literal": v} for k, v in claim_fields.items()},
+            "claimedAt": {"$cond": [held_by_user, {"$ifNull": ["$claimedAt", now]}, now]},
         }},
+        {"$unset": ["reservedBy", "reservedAt"]},
+    ]
+    # 原子查找并更新锁定时间：先绕开别人仍有效的软预留
+    # 取更新前的文档，以便判断是否接手了别人过期的锁
+    prev = coll.find_one_and_update(
+        {"$and": [filter_query, not_reserved_by_others(user, now)]},
+        claim_update,
         sort=[("skippedAt", 1), ("number", 1)],
-        return_document=ReturnDocument.AFTER
+        return_document=ReturnDocument.BEFORE
     )
-    if not doc:
+    if not prev:
+        # 剩下的都被别人预留了：软预留不阻止领取
+        prev = coll.find_one_and_update(
+            filter_query,
+            claim_update,
+            sort=[("skippedAt", 1), ("number", 1)],
+            return_document=ReturnDocument.BEFORE
+        )
+    if not prev:
         raise HTTPException(status_code=404, detail="没有更多记录可供录入")
+    prev_locked_at = prev.get("lockedAt")
+    if isinstance(prev_locked_at, datetime) and prev_locked_at.tzinfo is None:
+        # pymongo 默认返回 naive UTC 时间
+        prev_locked_at = prev_locked_at.replace(tzinfo=timezone.utc)
+    reclaimed = (
+        prev.get("locked") is True
+        and prev.get("lockedBy") == user
+        and isinstance(prev_locked_at, datetime)
+        and prev_locked_at >= expired_cutoff
+    )
+    if prev.get("locked") and prev.get("lockedBy") not in (None, user):
+        event_log.record("expired", prev["_id"], prev.get("lockedBy"), prev.get("session"), takenBy=user)
+    if not reclaimed:
+        event_log.record("claim", prev["_id"], user, prev.get("session"))
+    lease_tracker.track(prev["_id"], user)
+    doc = {k: v for k, v in prev.items() if k not in ("reservedBy", "reservedAt")}
+    doc.update(claim_fields)
+    claimed_at = prev.get("claimedAt") if reclaimed else None
+    if isinstance(claimed_at, datetime) and claimed_at.tzinfo is None:
+        claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+    doc["claimedAt"] = claimed_at or now
     # --- 保留 locked 字段，方便前端判断 ---
     stringify_id(doc)
     # 兼容旧字段名
@@ -189,7 +329,33 @@ def get_next_record(session: Optional[str] = Query(None, description="Session ID
         except ValueError:
             pass
 
+    if include_images:
+        # 同步路由已运行在线程池中，直接阻塞列目录
+        doc["images"] = image_manifest(doc["session"], doc["number"])
+    if prefetch and user:
+        doc["upNext"] = reserve_up_next(base_filter, doc["_id"], user, now)
+
+    # 只取缓存中已生成的草稿，领取路径不等待模型
+    draft_input = DraftInput.from_record(doc)
+    doc["draft"] = generator.peek(draft_input)
+    if doc["draft"] is None:
+        background_tasks.add_task(generator.generate, draft_input)
+    background_tasks.add_task(generator.prefetch_session, session)
+
     return doc
+# ===========================
+# 生成标题/描述草稿
+# ===========================
+@router.post("/draft")
+async def generate_draft(payload: DraftPayload):
+    """
+    返回 {title, description} 草稿，结果按输入内容缓存
+    """
+    try:
+        return await generator.generate(DraftInput.of(payload.label, payload.note, payload.condition))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"草稿生成失败: {e}")
+
 # # ===========================
 # # 心跳续租接口
 @router.post("/renew")
@@ -197,14 +363,20 @@ def renew_lock(payload: dict, user: Optional[str] = Query(None, description="当
     # 续租锁定时间
     """
     前端定时调用此接口续租锁定时间，避免过期
+    本进程已确认持有的锁只在内存中续租，由 lease_tracker 定期批量写回；
+    否则直接写库校验所有权
     """
     try:
         rid = ObjectId(payload["_id"])
     except:
         raise HTTPException(status_code=422, detail="无效的记录ID")
     
-    coll = get_collection("qa_bot")
     now = datetime.now(timezone.utc)
+    if lease_tracker.renew(rid, user, now):
+        event_log.record("renew", rid, user)
+        return {"message": "锁续租成功", "locked": True, "lockedAt": now.isoformat()}
+
+    coll = get_collection("qa_bot")
     #2 仅对已锁定的文档更新lockedAt
     res = coll.update_one(
         {"_id": rid, "locked": True, "lockedBy": user},
@@ -212,7 +384,10 @@ def renew_lock(payload: dict, user: Optional[str] = Query(None, description="当
     )
     if res.matched_count == 0:
         # 如果没有匹配到，说明文档不存在或未锁定
+        event_log.record("renew_failed", rid, user)
         raise HTTPException(status_code=403, detail="锁续租失败：锁已失效或不是你的锁")
+    lease_tracker.track(rid, user)
+    event_log.record("renew", rid, user)
     # 返回当前时间作为续租成功的标志
     return {"message": "锁续租成功", "locked": True, "lockedAt": now.isoformat()}
 
@@ -239,9 +414,11 @@ def unlock_record(payload: dict, user: Optional[str] = Query(None, description="
         {"_id": rid}, 
         {
             "$set": {"locked": False},
-            "$unset": {"lockedAt": "", "lockedBy": ""}  # 清除锁定时间
+            "$unset": {"lockedAt": "", "lockedBy": "", "claimedAt": ""}  # 清除锁定时间
         }
     )
+    lease_tracker.forget(rid)
+    event_log.record("unlock", rid, user, doc.get("session") if doc else None)
     # 既然匹配到了 ID，就算成功
     return {"message": "已解锁"}
 
@@ -279,9 +456,18 @@ def skip_record(payload: dict, user: Optional[str] = Query(None, description="
     orig.pop("locked", None)
     orig.pop("lockedAt", None)
     orig.pop("lockedBy", None)
+    orig.pop("reservedBy", None)
+    orig.pop("reservedAt", None)
+    orig.pop("claimedAt", None)
     orig["locked"] = False
     orig["skippedAt"] = datetime.now(timezone.utc).isoformat()
-    coll.insert_one(orig)
+    try:
+        coll.insert_one(orig)
+    except DuplicateKeyError:
+        # 删除与重插之间 QC 又提交了同一编号，队列中已有该记录
+        pass
+    lease_tracker.forget(rid)
+    event_log.record("skip", rid, user, orig.get("session"))
     return {"message": "跳过成功"}
 
 
@@ -298,6 +484,7 @@ def submit_record(payload: SubmitPayload, user: Optional[str] = Query(None, desc
     orig = qa_coll.find_one_and_delete({"_id": rid, "locked": True, "lockedBy": user})
     if not orig:
         raise HTTPException(403, "只能提交自己锁定的记录，或记录已被移除")
+    lease_tracker.forget(rid)
 
     # 构建要写入 check_done 的文档
     data = payload.dict(by_alias=True, exclude_none=True)
@@ -311,7 +498,7 @@ def submit_record(payload: SubmitPayload, user: Optional[str] = Query(None, desc
         "Price": data["price"],
         "Title": data["title"],
         "Note": data["note"],
-        "Description": data["description"],
+        "Description": render_description(data["description"]),  # 服务端补全模板并生成最终文本
         "Location": data["location"],
         "Product_image": images,
         "Cover_image": images[0] if images else "",
@@ -329,6 +516,21 @@ def submit_record(payload: SubmitPayload, user: Optional[str] = Query(None, desc
         # 理论上几乎不会发生，除非写入失败
         raise HTTPException(500, "写入 check_done 失败")
 
+    claimed_at = orig.get("claimedAt")
+    duration_ms = None
+    if isinstance(claimed_at, datetime):
+        if claimed_at.tzinfo is None:
+            # pymongo 默认返回 naive UTC 时间
+            claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+        duration_ms = int((datetime.now(timezone.utc) - claimed_at).total_seconds() * 1000)
+    event_log.record("submit", rid, user, orig.get("session"), durationMs=duration_ms)
+    # 缩略图等后续处理交给后台任务，不占用录入请求时间
+    try:
+        # 用队列文档里的 session/number：与磁盘上的目录名一致（提交数据中的 Number 已被转成整数）
+        enqueue("thumbnails", {"session": orig.get("session"), "number": str(orig.get("number"))})
+    except Exception:
+        traceback.print_exc()
+
     return {"message": "录入成功"}
 
 @router.post("/update_url")
@@ -346,29 +548,28 @@ def update_url(payload: UpdateUrlPayload, user: Optional[str] = Query(None, desc
 # 列出指定 session 和 number 下的图片文件名
 # ===========================
 @router.get("/images/{session}/{number}")
-def list_image_files(session: str, number: str):
+async def list_image_files(session: str, number: str):
     """
-    根据 session（批次）和 number（编号）拼接本地目录，
+    根据 session（批次）和 number（编号）拼接目录，
     列出所有支持的图片文件名
     """
-    folder = os.path.join(IMAGE_ROOT, session, number)
-    if not os.path.isdir(folder):
-        return []
-    exts = {".jpg", ".jpeg", ".png", ".webp"}
-    files = [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f)) and os.path.splitext(f)[1].lower() in exts]
-    return sorted(files)
+    try:
+        return await list_record_images(session, number)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法路径")
 
 # ========== 新增接口: 删除图片 ==========
 @router.delete("/image/{session}/{number}/{filename}")
-def delete_image(session: str, number: str, filename: str):
+async def delete_image(session: str, number: str, filename: str):
     """
     删除指定 session/number 下的单个图片文件
     """
-    folder = os.path.join(IMAGE_ROOT, session, number)
-    file_path = os.path.join(folder, filename)
-    if not os.path.isfile(file_path):
+    try:
+        key = join_key(session, number, filename)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法路径")
+    if not await record_images.delete(key):
         raise HTTPException(status_code=404, detail="文件不存在")
-    os.remove(file_path)
     return {"message": "删除成功"}
 
 
@@ -381,19 +582,17 @@ async def upload_image(
     number: str = Form(...)
 ):
     """
-    接收图片文件，保存到本地目录 {IMAGE_ROOT}/{session}/{number}/{filename}.{ext}
+    接收图片文件，保存到 {session}/{number}/{filename}.{ext}
     返回可访问的 URL
     """
-    # 构建目录
-    folder = os.path.join(IMAGE_ROOT, session, number)
-    os.makedirs(folder, exist_ok=True)
-    # 推断扩展名并保存
+    # 推断扩展名并保存（按块从上传临时文件拷贝，不整体读入内存）
     ext = os.path.splitext(file.filename)[1]
     save_name = f"{filename}{ext}"
-    save_path = os.path.join(folder, save_name)
-    content = await file.read()
-    with open(save_path, "wb") as f:
-        f.write(content)
+    try:
+        key = join_key(session, number, save_name)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="非法路径")
+    await record_images.put(key, file.file)
     # 返回前端可直接访问的路径
     url = f"/api/images/{session}/{number}/{save_name}"
     return {"url": url}
\ No newline at end of file
@@ -3,8 +3,10 @@ from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from services.db import get_collection
-from typing import List
+from services.db import get_analytics_collection
+from services.task_queue import queue_depth, task_queue
+from typing import Any, Dict, List, Optional
+import math
 import traceback
 
 router = APIRouter()
@@ -22,7 +24,7 @@ def qc_daily_stats(days: int = Query(14, ge=1, le=90)):
     - per_user: 每天每个 user 的数量（用于拆分图）
     """
     try:
-        qa_coll = get_collection("qa_bot_test")  # 如果质检在其它 collection，请改这里
+        qa_coll = get_analytics_collection("qa_bot_test")  # 如果质检在其它 collection，请改这里
 
         # 统一用多伦多本地时间
         tz = ZoneInfo("America/Toronto")
@@ -126,7 +128,7 @@ def qc_daily_stats(days: int = Query(14, ge=1, le=90)):
 @router.get("/daily", response_model=List[StatsItem])
 def daily_stats():
     try:
-        col = get_collection("check_done")
+        col = get_analytics_collection("check_done")
         tz = ZoneInfo("America/Toronto")
         now = datetime.now(tz)
         start_of_today = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -184,3 +186,101 @@ def daily_stats():
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"统计接口异常: {e}")
+
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """最近秩法百分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@router.get("/cycle")
+def cycle_time_stats(
+    start: Optional[str] = Query(None, description="开始日期 YYYY-MM-DD（多伦多时间，含）"),
+    end: Optional[str] = Query(None, description="结束日期 YYYY-MM-DD（多伦多时间，含）"),
+):
+    """
+    基于 record_events 统计每个录货员在日期范围内（默认最近 7 天）的：
+    - claims / submits / skips / expired：领取、提交、跳过、锁过期被他人接手的次数
+    - skipRate / expiryRate：跳过、过期次数占领取次数的比例
+    - cycleSeconds：从领取到提交耗时的 p50 / p90 / p95（秒）
+    """
+    tz = ZoneInfo("America/Toronto")
+    try:
+        today = datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        end_date = (datetime.strptime(end, "%Y-%m-%d").replace(tzinfo=tz) if end else today) + timedelta(days=1)
+        start_date = datetime.strptime(start, "%Y-%m-%d").replace(tzinfo=tz) if start else end_date - timedelta(days=7)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="日期格式应为 YYYY-MM-DD")
+    if start_date >= end_date:
+        raise HTTPException(status_code=422, detail="开始日期不能晚于结束日期")
+
+    try:
+        col = get_analytics_collection("record_events")
+        pipeline = [
+            {
+                "$match": {
+                    "at": {"$gte": start_date, "$lt": end_date},
+                    "event": {"$in": ["claim", "submit", "skip", "expired"]},
+                }
+            },
+            {
+                "$group": {
+                    "_id": {"user": "$user", "event": "$event"},
+                    "count": {"$sum": 1},
+                    "durations": {"$push": "$durationMs"},
+                }
+            },
+        ]
+        per_user: Dict[str, Dict[str, Any]] = {}
+        for row in col.aggregate(pipeline):
+            user = row["_id"].get("user") or ""
+            event = row["_id"]["event"]
+            item = per_user.setdefault(user, {"claim": 0, "submit": 0, "skip": 0, "expired": 0, "durations": []})
+            item[event] = row["count"]
+            if event == "submit":
+                item["durations"] = sorted(d / 1000 for d in row["durations"] if d is not None)
+
+        result = []
+        for user in sorted(per_user):
+            item = per_user[user]
+            claims = item["claim"]
+            durations = item["durations"]
+            result.append({
+                "recorder": user,
+                "claims": claims,
+                "submits": item["submit"],
+                "skips": item["skip"],
+                "expired": item["expired"],
+                "skipRate": round(item["skip"] / claims, 4) if claims else None,
+                "expiryRate": round(item["expired"] / claims, 4) if claims else None,
+                "cycleSeconds": {
+                    "p50": _percentile(durations, 50),
+                    "p90": _percentile(durations, 90),
+                    "p95": _percentile(durations, 95),
+                },
+            })
+        return {
+            "start": start_date.strftime("%Y-%m-%d"),
+            "end": (end_date - timedelta(days=1)).strftime("%Y-%m-%d"),
+            "recorders": result,
+        }
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"录入耗时统计接口异常: {e}")
+
+
+@router.get("/jobs")
+def job_queue_stats():
+    """
+    后台任务队列指标：
+    - depth: 各任务类型 queued / running / failed 数量（所有进程）
+    - running: 本 worker 进程正在执行的数量
+    """
+    try:
+        return {"depth": queue_depth(), "running": task_queue.running()}
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"任务队列统计接口异常: {e}")
@@ -0,0 +1,48 @@
+# backend/routes/templates.py
+
+from typing import Any, Dict
+
+from fastapi import APIRouter, Request, Response
+
+from services.condition_templates import catalog, render_description
+
+router = APIRouter()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # 弱校验：忽略 W/ 前缀
+    return any(t.removeprefix("W/") == etag for t in tags)
+
+
+# ===========================
+# 获取模板目录（支持 ETag 协商缓存）
+# ===========================
+@router.get("")
+def get_templates(request: Request):
+    """
+    返回 {version, templates: {category: [...]}}。
+    客户端带 If-None-Match 重新验证，版本未变时返回 304 空响应。
+    """
+    snap = catalog.snapshot()
+    etag = f'"{snap.version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snap.body, media_type="application/json", headers=headers)
+
+
+@router.post("/reload")
+def reload_templates():
+    """修改数据库中的模板后调用，立即刷新本 worker 的目录（其余 worker 按刷新周期生效）"""
+    snap = catalog.reload()
+    return {"version": snap.version}
+
+
+@router.post("/render")
+def render_templates(description: Dict[str, Any]):
+    """预览：按提交时相同的规则组装描述"""
+    return render_description(description)
@@ -0,0 +1,272 @@
+# backend/services/ai_generator.py
+"""
+标题/描述草稿生成服务。
+
+- 后端可插拔：通过 register_backend 注册，AI_GENERATOR_BACKEND 选择，默认 "local"
+  （确定性的本地实现，不依赖模型，测试/离线环境使用）；也可直接写工厂的导入路径，
+  如 "myapp.backends:RemoteBackend"。后端在 start() 时才解析，注册可以晚于本模块导入
+- 请求先进 asyncio 队列，由后台任务按批（AI_BATCH_SIZE / AI_BATCH_WAIT_MS）交给后端
+- 以 (label, note, condition) 为键缓存结果，相同输入只生成一次；同一时刻的重复请求共享同一个 Future
+- prefetch_session 为 session 中接下来几条未领取记录提前生成草稿，/next 直接从缓存取，不增加领取延迟
+"""
+import abc
+import asyncio
+import importlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    AI_GENERATOR_BACKEND,
+    AI_BATCH_SIZE,
+    AI_BATCH_WAIT_MS,
+    AI_CACHE_SIZE,
+    AI_PREFETCH_COUNT,
+)
+from services.db import get_collection
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@dataclass(frozen=True)
+class DraftInput:
+    """生成草稿的输入，同时作为缓存键（已规范化）"""
+    label: str
+    note: str
+    condition: str = ""
+
+    @classmethod
+    def of(cls, label: Any, note: Any, condition: Any = "") -> "DraftInput":
+        return cls(
+            label=str(label or "").strip().upper(),
+            note=" ".join(str(note or "").split()),
+            condition=" ".join(str(condition or "").split()),
+        )
+
+    @classmethod
+    def from_record(cls, doc: Dict[str, Any]) -> "DraftInput":
+        """从 qa_bot 文档构造输入"""
+        return cls.of(doc.get("label"), doc.get("note"), doc.get("condition", ""))
+
+
+# ===========================
+# 可插拔后端
+# ===========================
+class GenerationBackend(abc.ABC):
+    """生成后端基类：一次处理一批输入，按顺序返回草稿 {title, description}"""
+    name = "base"
+
+    @abc.abstractmethod
+    async def generate_batch(self, items: List[DraftInput]) -> List[Dict[str, Any]]:
+        ...
+
+
+class LocalBackend(GenerationBackend):
+    """
+    本地确定性实现：直接由质检备注拼出标题和描述，相同输入总是得到相同输出。
+    """
+    name = "local"
+    max_title_len = 80
+
+    async def generate_batch(self, items: List[DraftInput]) -> List[Dict[str, Any]]:
+        return [self._draft(item) for item in items]
+
+    def _draft(self, item: DraftInput) -> Dict[str, Any]:
+        first_line = item.note.split(".")[0].strip() if item.note else ""
+        title = first_line[: self.max_title_len].strip().title()
+        return {
+            "title": title,
+            "description": {
+                "condition": item.condition,
+                "inspectionNotes": item.note,
+            },
+        }
+
+
+_BACKENDS: Dict[str, Callable[[], GenerationBackend]] = {
+    LocalBackend.name: LocalBackend,
+}
+
+
+def register_backend(name: str, factory: Callable[[], GenerationBackend]) -> None:
+    """注册新的生成后端，例如接入模型服务"""
+    _BACKENDS[name] = factory
+
+
+def create_backend(name: str) -> GenerationBackend:
+    """按注册名创建后端；未注册且形如 "module:attr" 的按导入路径加载工厂"""
+    factory = _BACKENDS.get(name)
+    if factory is None and ":" in name:
+        module, _, attr = name.partition(":")
+        try:
+            factory = getattr(importlib.import_module(module), attr)
+        except (ImportError, AttributeError) as e:
+            raise ValueError(f"无法加载生成后端 {name}: {e}")
+    if factory is None:
+        raise ValueError(f"未知的生成后端: {name}")
+    return factory()
+
+
+# ===========================
+# 批处理 + 缓存
+# ===========================
+class DraftGenerator:
+    def __init__(
+        self,
+        backend: Optional[GenerationBackend] = None,
+        backend_name: str = AI_GENERATOR_BACKEND,
+        batch_size: int = AI_BATCH_SIZE,
+        batch_wait_ms: int = AI_BATCH_WAIT_MS,
+        cache_size: int = AI_CACHE_SIZE,
+    ):
+        # 未直接传入后端时，首次使用（或 start）时按 backend_name 创建
+        self.backend = backend
+        self.backend_name = backend_name
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0, batch_wait_ms) / 1000
+        self.cache_size = cache_size
+        # /next 在线程池里读缓存，所以用线程锁保护
+        self._cache: "OrderedDict[DraftInput, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._inflight: Dict[DraftInput, asyncio.Future] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    # ---------- 生命周期（在 app lifespan 中调用） ----------
+    def _backend(self) -> GenerationBackend:
+        if self.backend is None:
+            self.backend = create_backend(self.backend_name)
+        return self.backend
+
+    async def start(self) -> None:
+        # 启动时解析后端，配置错误在启动阶段暴露
+        self._backend()
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._queue = None
+        for fut in self._inflight.values():
+            if not fut.done():
+                fut.cancel()
+        self._inflight.clear()
+
+    # ---------- 缓存 ----------
+    def peek(self, item: DraftInput) -> Optional[Dict[str, Any]]:
+        """只查缓存，不触发生成（线程安全，可在同步路由中调用）"""
+        with self._cache_lock:
+            draft = self._cache.get(item)
+            if draft is not None:
+                self._cache.move_to_end(item)
+            return draft
+
+    def _store(self, item: DraftInput, draft: Dict[str, Any]) -> None:
+        with self._cache_lock:
+            self._cache[item] = draft
+            self._cache.move_to_end(item)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------- 生成 ----------
+    def submit(self, item: DraftInput) -> "asyncio.Future":
+        """
+        将输入放入批处理队列，返回 Future。已缓存或已在生成中的输入不会重复入队。
+        必须在事件循环中调用。
+        """
+        loop = asyncio.get_running_loop()
+        cached = self.peek(item)
+        if cached is not None:
+            fut = loop.create_future()
+            fut.set_result(cached)
+            return fut
+        fut = self._inflight.get(item)
+        if fut is not None:
+            return fut
+        fut = loop.create_future()
+        self._inflight[item] = fut
+        if self._queue is None:
+            # 未启动批处理（例如脚本中直接使用），退化为单条直接生成
+            asyncio.create_task(self._process([item]))
+        else:
+            self._queue.put_nowait(item)
+        return fut
+
+    async def generate(self, item: DraftInput) -> Dict[str, Any]:
+        return await asyncio.shield(self.submit(item))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._process(batch)
+
+    async def _process(self, batch: List[DraftInput]) -> None:
+        try:
+            drafts = await self._backend().generate_batch(batch)
+            if len(drafts) != len(batch):
+                raise RuntimeError("生成后端返回数量与请求不一致")
+        except Exception as e:
+            logger.exception("草稿生成失败（%d 条）", len(batch))
+            for item in batch:
+                fut = self._inflight.pop(item, None)
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+            return
+        for item, draft in zip(batch, drafts):
+            self._store(item, draft)
+            fut = self._inflight.pop(item, None)
+            if fut is not None and not fut.done():
+                fut.set_result(draft)
+
+    # ---------- 预生成 ----------
+    async def prefetch_session(self, session: Optional[str], count: int = AI_PREFETCH_COUNT) -> None:
+        """
+        为 session 中接下来 count 条未领取记录预生成草稿（排序与 /next 一致）。
+        作为 /next 的后台任务执行，不等待生成结果。
+        """
+        if count <= 0:
+            return
+        query: Dict[str, Any] = {"locked": False}
+        if session:
+            query["session"] = session
+
+        def _load() -> List[Dict[str, Any]]:
+            cursor = get_collection("qa_bot").find(
+                query, {"label": 1, "note": 1, "condition": 1}
+            ).sort([("skippedAt", 1), ("number", 1)]).limit(count)
+            return list(cursor)
+
+        try:
+            docs = await run_in_threadpool(_load)
+        except Exception:
+            logger.exception("预生成草稿时读取记录失败")
+            return
+        for doc in docs:
+            fut = self.submit(DraftInput.from_record(doc))
+            # 预生成失败只记日志，避免 "Future exception was never retrieved"
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+# 进程内单例；批处理任务在 app lifespan 中启动
+generator = DraftGenerator()
@@ -0,0 +1,354 @@
+# backend/services/archive.py
+"""
+已结束批次（session）的归档。
+
+qa_bot / check_done 只保留进行中的批次，索引和统计管道只为热数据付出代价：
+- 归档把一个 session 的 check_done（以及残留的 qa_bot）文档按批搬到按年份分的归档集合
+  （check_done_archive_2025、qa_bot_archive_2025 ...）。每批先写入归档集合，
+  按 _id 回查确认全部落盘后才从在线集合删除；中途失败可直接重跑（按 _id 幂等）
+- session_archive 集合是目录：记录每个 session 所在的归档集合和状态。
+  archiving 期间读接口同时查在线和归档集合，archived 之后只查归档集合
+- 可选把图片目录导出为 tar.gz 冷存储（ARCHIVE_EXPORT_DIR），校验后可删除原图片
+
+读接口通过 collections_for(name, session) 拿到该 session 应查询的集合列表。目录在进程内缓存
+ARCHIVE_CATALOG_REFRESH_SECONDS 秒，请求路径不额外查库；归档命令登记 archiving 后
+先等待一个刷新周期再开始搬移，保证各 worker 搬移期间都已同时查询两边。
+
+命令行（在 backend 目录下执行）：
+
+    python -m services.archive 2024-11A --export
+    python -m services.archive 2024-11A --dry-run
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import tarfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+from anyio import from_thread, to_thread
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from config import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_EXPORT_DIR,
+    ARCHIVE_CATALOG_REFRESH_SECONDS,
+    LOCK_TIMEOUT_SECONDS,
+)
+from services.db import get_collection
+from services.image_handler import ImageStorage, record_images, qc_images, join_key
+
+logger = logging.getLogger("uvicorn.error")
+
+CATALOG = "session_archive"
+
+# 在线集合 -> (session 字段名, 时间字段名)
+SOURCES = {
+    "check_done": ("Session", "Record_time"),
+    "qa_bot": ("session", "timestamp"),
+}
+
+# 与 db.ensure_indexes 中在线集合的索引保持一致（归档集合不要求唯一）
+ARCHIVE_INDEXES = {
+    "check_done": [("Session", 1), ("Label", 1), ("Number", 1)],
+    "qa_bot": [("session", 1), ("label", 1), ("number", 1)],
+}
+
+
+def archive_name(name: str, period: str) -> str:
+    return f"{name}_archive_{period}"
+
+
+def _catalog() -> Collection:
+    return get_collection(CATALOG)
+
+
+class ArchiveCatalog:
+    """session_archive 目录的进程内缓存，过期后整表重新加载（目录很小，每个 session 一条）"""
+
+    def __init__(self, refresh_seconds: int = ARCHIVE_CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self) -> Dict[str, Dict[str, Any]]:
+        """强制从数据库重新加载"""
+        entries = {d["_id"]: d for d in _catalog().find({}, {"status": 1, "period": 1})}
+        with self._lock:
+            self._entries = entries
+            self._loaded_at = time.monotonic()
+        return entries
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """返回当前目录，过期时重新加载"""
+        entries = self._entries
+        if entries is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return entries
+        return self.reload()
+
+    def get(self, session: str) -> Optional[Dict[str, Any]]:
+        return self.entries().get(session)
+
+
+catalog = ArchiveCatalog()
+
+
+# ===========================
+# 读接口：按 session 选择集合
+# ===========================
+def collections_for(name: str, session: Optional[str], collection=get_collection) -> List[Collection]:
+    """
+    返回查询某个 session 时应访问的集合：
+    - 未归档（或 session 为空，查全部在线数据）：[在线集合]
+    - 归档中：[在线集合, 归档集合]（同一文档可能短暂同时存在于两边，调用方按需去重）
+    - 已归档：[归档集合]
+    collection 可传 get_analytics_collection 以走分析连接池。
+    """
+    if not session:
+        return [collection(name)]
+    entry = catalog.get(session)
+    if entry is None:
+        return [collection(name)]
+    archived = collection(archive_name(name, entry["period"]))
+    if entry.get("status") == "archived":
+        return [archived]
+    return [collection(name), archived]
+
+
+def archived_sessions() -> List[str]:
+    """已归档（含归档中）的 session 列表"""
+    return sorted(catalog.entries())
+
+
+# ===========================
+# 归档
+# ===========================
+def _period(session: str) -> str:
+    """按 check_done 中最晚的录入时间取年份；取不到时用当前年份"""
+    session_field, time_field = SOURCES["check_done"]
+    last = get_collection("check_done").find_one(
+        {session_field: session, time_field: {"$type": "string"}},
+        {time_field: 1},
+        sort=[(time_field, -1)],
+    )
+    value = (last or {}).get(time_field) or ""
+    if value[:4].isdigit():
+        return value[:4]
+    return str(datetime.now(timezone.utc).year)
+
+
+def _active_locks(session: str) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=LOCK_TIMEOUT_SECONDS)
+    return get_collection("qa_bot").count_documents(
+        {"session": session, "locked": True, "lockedAt": {"$gte": cutoff}}
+    )
+
+
+def _move(name: str, session: str, period: str, batch_size: int) -> int:
+    """按 _id 分批把 session 的文档搬到归档集合，返回搬移条数"""
+    session_field, _ = SOURCES[name]
+    source = get_collection(name)
+    target = get_collection(archive_name(name, period))
+    target.create_index(ARCHIVE_INDEXES[name])
+    moved = 0
+    while True:
+        batch = list(source.find({session_field: session}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return moved
+        ids = [doc["_id"] for doc in batch]
+        try:
+            target.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # 重跑时上次已写入的文档会撞 _id，忽略；其他错误照常抛出
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        confirmed = target.count_documents({"_id": {"$in": ids}})
+        if confirmed != len(ids):
+            raise RuntimeError(f"{name} 归档校验失败：应有 {len(ids)} 条，归档集合中只有 {confirmed} 条")
+        moved += source.delete_many({"_id": {"$in": ids}}).deleted_count
+
+
+def archive_session(
+    session: str,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    归档一个已结束的 session（阻塞）。仍有有效锁的 session 视为未结束，拒绝归档。
+    """
+    entry = _catalog().find_one({"_id": session})
+    period = entry["period"] if entry else _period(session)
+    pending = {
+        name: get_collection(name).count_documents({field: session})
+        for name, (field, _) in SOURCES.items()
+    }
+    result: Dict[str, Any] = {"session": session, "period": period, "pending": pending}
+    if dry_run:
+        return result
+    if _active_locks(session):
+        raise RuntimeError(f"session {session} 仍有正在录入的记录，不能归档")
+
+    now = datetime.now(timezone.utc)
+    # 先登记为 archiving：搬移期间读接口同时查两边，不会出现数据暂时“消失”
+    _catalog().update_one(
+        {"_id": session},
+        {
+            "$set": {"status": "archiving", "updatedAt": now},
+            "$setOnInsert": {
+                "period": period,
+                "collections": {name: archive_name(name, period) for name in SOURCES},
+                "createdAt": now,
+            },
+        },
+        upsert=True,
+    )
+    if entry is None or entry.get("status") != "archiving":
+        # 各 worker 的目录缓存最多落后 refresh_seconds：等它们都开始同时查询两边后再搬移
+        logger.info("已登记 %s 为 archiving，等待 %s 秒后开始搬移", session, catalog.refresh_seconds)
+        time.sleep(catalog.refresh_seconds)
+    moved = {name: _move(name, session, period, batch_size) for name in SOURCES}
+    counts = {
+        name: get_collection(archive_name(name, period)).count_documents({field: session})
+        for name, (field, _) in SOURCES.items()
+    }
+    _catalog().update_one(
+        {"_id": session},
+        {"$set": {"status": "archived", "counts": counts, "archivedAt": datetime.now(timezone.utc)}},
+    )
+    result.update(moved=moved, counts=counts)
+    return result
+
+
+# ===========================
+# 图片冷存储导出
+# ===========================
+async def _walk(storage: ImageStorage, prefix: str) -> List[str]:
+    keys = [join_key(prefix, name) for name in await storage.list(prefix)]
+    for sub in await storage.list_dirs(prefix):
+        keys.extend(await _walk(storage, join_key(prefix, sub)))
+    return keys
+
+
+class _StreamReader(io.RawIOBase):
+    """
+    在工作线程中把存储的异步分块流包装成同步文件对象，供 tarfile 逐块读取，
+    不把整个文件读进内存。
+    """
+
+    def __init__(self, storage: ImageStorage, key: str, size: int):
+        self._chunks = from_thread.run(partial(storage.open_stream, key, length=size))
+        self._buf = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf and not self._eof:
+            try:
+                self._buf = from_thread.run(self._chunks.__anext__)
+            except StopAsyncIteration:
+                self._eof = True
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def _write_tar(path: str, items: List[Tuple[str, ImageStorage, str]]) -> None:
+    """在工作线程中执行；文件比列出时短（中途被删改）时 tarfile 抛 OSError"""
+    mtime = int(datetime.now(timezone.utc).timestamp())
+    with tarfile.open(path, "w:gz") as tar:
+        for arcname, storage, key in items:
+            info = tarfile.TarInfo(arcname)
+            info.size = from_thread.run(storage.size, key)
+            info.mtime = mtime
+            tar.addfile(info, _StreamReader(storage, key, info.size))
+
+
+async def export_images(session: str, purge: bool = False) -> Dict[str, Any]:
+    """
+    把 session 的录货图片和质检图片打包为 ARCHIVE_EXPORT_DIR/{session}.tar.gz
+    （包内为 record/... 和 qc/...；两者指向同一目录时只打包一次）。
+    purge=True 时在校验包内文件数后删除原图片。
+    """
+    os.makedirs(ARCHIVE_EXPORT_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_EXPORT_DIR, f"{join_key(session)}.tar.gz")
+    tmp = path + ".part"
+    sources: Dict[str, ImageStorage] = {}
+    for name, storage in (("record", record_images), ("qc", qc_images)):
+        if all(storage.location() != s.location() for s in sources.values()):
+            sources[name] = storage
+    keys = {name: await _walk(storage, join_key(session)) for name, storage in sources.items()}
+    items = [
+        (f"{name}/{key}", storage, key)
+        for name, storage in sources.items()
+        for key in keys[name]
+    ]
+    try:
+        await to_thread.run_sync(_write_tar, tmp, items)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    with tarfile.open(tmp, "r:gz") as tar:
+        members = len(tar.getmembers())
+    total = len(items)
+    if members != total:
+        os.remove(tmp)
+        raise RuntimeError(f"导出校验失败：应有 {total} 个文件，压缩包中 {members} 个")
+    os.replace(tmp, path)
+
+    purged = 0
+    if purge:
+        for name, storage in sources.items():
+            for key in keys[name]:
+                purged += bool(await storage.delete(key))
+    _catalog().update_one(
+        {"_id": session},
+        {"$set": {"export": {"path": path, "files": total, "purged": purged}}},
+    )
+    return {"path": path, "files": total, "purged": purged}
+
+
+# ===========================
+# 命令行
+# ===========================
+def main(argv: Optional[List[str]] = None) -> int:
+    import anyio
+
+    from routes.qc import get_current_session
+
+    parser = argparse.ArgumentParser(description="归档已结束的 session")
+    parser.add_argument("session")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="只统计待归档条数")
+    parser.add_argument("--export", action="store_true", help="导出图片目录为 tar.gz")
+    parser.add_argument("--purge-images", action="store_true", help="导出校验通过后删除原图片")
+    parser.add_argument("--force", action="store_true", help="允许归档当前 session")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.session == get_current_session() and not args.force:
+        print(f"{args.session} 是当前 session，确认要归档请加 --force", file=sys.stderr)
+        return 1
+    try:
+        result = archive_session(args.session, max(1, args.batch_size), args.dry_run)
+        print(result)
+        if args.export and not args.dry_run:
+            print(anyio.run(export_images, args.session, args.purge_images))
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
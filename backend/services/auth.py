@@ -1,7 +1,7 @@
 # backend/services/auth.py
 from fastapi import HTTPException, Header
 from passlib.context import CryptContext
-from services.db import users_collection
+from services.db import get_users_collection
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -9,7 +9,7 @@ async def verify_credentials(username: str, password: str):
     """
     验证用户名和密码，返回 {username, role} 或抛出 HTTPException。
     """
-    user = users_collection.find_one({"username": username})
+    user = get_users_collection().find_one({"username": username})
     if not user or not pwd_context.verify(password, user["hashed_password"]):
         raise HTTPException(status_code=401, detail="用户名或密码不正确")
     return {"username": user["username"], "role": user["role"]}
@@ -24,7 +24,7 @@ async def get_current_user(authorization: str = Header(None)):
     if len(parts) != 2:
         raise HTTPException(status_code=401, detail="无效认证头")
     token = parts[1]
-    user = users_collection.find_one({"username": token})
+    user = get_users_collection().find_one({"username": token})
     if not user:
         raise HTTPException(status_code=401, detail="无效用户")
     return {"username": user["username"], "role": user["role"]}
@@ -0,0 +1,171 @@
+# backend/services/condition_templates.py
+"""
+商品描述模板目录（成色 / 品牌声明 / Buyer Notice 预设）。
+
+- 模板存放在 MongoDB condition_templates 集合，集合为空时用 DEFAULT_TEMPLATES 初始化
+- 每个进程加载一次并编译成按 category 分组的内存索引，同时预先序列化好响应体和版本号（ETag）
+- 每 TEMPLATE_REFRESH_SECONDS 秒重新加载一次，多 worker 下修改模板后最多延迟该时间生效
+- render_description 在提交时由服务端拼出最终描述文本
+"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from config import TEMPLATE_REFRESH_SECONDS
+from services.db import get_collection
+
+COLLECTION = "condition_templates"
+
+# 初始模板，与原 RecordForm.tsx 中写死的文案一致
+DEFAULT_TEMPLATES: List[Dict[str, Any]] = [
+    {"category": "brand", "key": "authentic", "label": "Authentic", "order": 1,
+     "text": "This item is 100% Authentic."},
+    {"category": "brand", "key": "counterfeit", "label": "Counterfeit", "order": 2,
+     "text": "Unbranded / Not Authenticated.\nBrand not verified. May not be an official/original product."},
+    {"category": "condition", "key": "BN", "label": "BN", "order": 1,
+     "text": "Brand New(Unused; packaging unopened or in original factory packaging.). ",
+     "buyerNotice": ""},
+    {"category": "condition", "key": "NEW", "label": "NEW", "order": 2,
+     "text": "New (Opened for inspection. May be missing some original packaging. Opened but unused; appearance is flawless.)",
+     "buyerNotice": ""},
+    {"category": "condition", "key": "LN", "label": "LN", "order": 3,
+     "text": "Like New(Open box. No visible signs of use. Item is in excellent condition.)",
+     "buyerNotice": "The item has been previously opened, inspected, or briefly handled by another customer. It is in functional condition with little to no signs of wear.\nThe packaging may be incomplete, damaged, or non-original, but the item itself remains in good overall condition - closer to new than used."},
+    {"category": "condition", "key": "OB'", "label": "OB'", "order": 4,
+     "text": "Open Box - In Good Condition (Light signs of use. In good condition. May have minor cosmetic imperfections.)",
+     "buyerNotice": "This item has been opened and may show light signs of handling. It is functional. Packaging may be missing or not original. Please refer to photos for actual condition.\nGreat value for a quality item at a fraction of the retail price!"},
+    {"category": "condition", "key": "OB\"", "label": "OB\"", "order": 5,
+     "text": "Open Box - In Fair Condition (Visible wear. Fair condition. Signs of use; fully functional but cosmetic condition is fair.)",
+     "buyerNotice": "This item has been opened and may show signs of handling. It is functional. Packaging may be missing or not original. Please refer to photos for actual condition.\nGreat value for a quality item at a fraction of the retail price!"},
+    {"category": "buyer", "key": "device_test", "label": "Device Test", "order": 1,
+     "text": "Device is tested to the best of our ability, but full feature testing is not guaranteed."},
+    {"category": "buyer", "key": "diff_img", "label": "Diff Img", "order": 2,
+     "text": "The first slide is representative. Minor differences in color, model variant. Item received will be of similar quality and condition."},
+    {"category": "buyer", "key": "size", "label": "Size", "order": 3,
+     "text": "Please refer to the dimensions shown in the photos as a general reference. Actual measurements may vary slightly."},
+    {"category": "buyer", "key": "review_image", "label": "review image", "order": 4,
+     "text": "Please review all photos and descriptions before placing a bid."},
+]
+
+# 最终描述的段落顺序，与前端预览一致
+DESCRIPTION_SECTIONS: List[Tuple[str, str]] = [
+    ("about", "About"),
+    ("brandNotice", "Brand Notice"),
+    ("specifications", "Specifications"),
+    ("conditionDescription", "Condition"),
+    ("inspectionNotes", "Inspection Notes"),
+    ("buyerNotice", "Buyer Notice"),
+]
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """某一版本的模板目录：索引、版本号和预序列化的响应体"""
+    index: Dict[str, List[Dict[str, Any]]]
+    by_key: Dict[Tuple[str, str], Dict[str, Any]]
+    version: str
+    body: bytes = field(repr=False)
+
+
+def _compile(docs: List[Dict[str, Any]]) -> CatalogSnapshot:
+    index: Dict[str, List[Dict[str, Any]]] = {}
+    by_key: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for doc in sorted(docs, key=lambda d: (d["category"], d.get("order", 0), d["key"])):
+        tpl = {k: v for k, v in doc.items() if k not in ("_id", "category", "active")}
+        index.setdefault(doc["category"], []).append(tpl)
+        by_key[(doc["category"], doc["key"])] = tpl
+    version = hashlib.sha256(
+        json.dumps(index, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:16]
+    body = json.dumps({"version": version, "templates": index}, ensure_ascii=False).encode("utf-8")
+    return CatalogSnapshot(index=index, by_key=by_key, version=version, body=body)
+
+
+class TemplateCatalog:
+    def __init__(self, refresh_seconds: int = TEMPLATE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load_docs(self) -> List[Dict[str, Any]]:
+        coll = get_collection(COLLECTION)
+        docs = list(coll.find({"active": {"$ne": False}}, {"_id": 0}))
+        if docs:
+            return docs
+        # 集合为空：写入默认模板（多个 worker 同时初始化时靠唯一索引去重）
+        coll.create_index([("category", 1), ("key", 1)], unique=True)
+        try:
+            coll.insert_many([dict(t) for t in DEFAULT_TEMPLATES], ordered=False)
+        except BulkWriteError:
+            pass
+        return [dict(t) for t in DEFAULT_TEMPLATES]
+
+    def reload(self) -> CatalogSnapshot:
+        """强制从数据库重新加载"""
+        snapshot = _compile(self._load_docs())
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        return snapshot
+
+    def snapshot(self) -> CatalogSnapshot:
+        """返回当前目录，过期时重新加载"""
+        snap = self._snapshot
+        if snap is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return snap
+        return self.reload()
+
+    def get(self, category: str, key: str) -> Optional[Dict[str, Any]]:
+        return self.snapshot().by_key.get((category, key))
+
+
+catalog = TemplateCatalog()
+
+
+def _join(*parts: str) -> str:
+    return "\n".join(p for p in parts if p)
+
+
+def render_description(description: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    服务端组装最终描述：
+    - conditionKey / brandKey / buyerKeys 引用模板时，补全对应文本
+      （前端已填写的文本优先，模板 buyerNotice 放在自定义内容之前）
+    - 生成 text 字段：按 DESCRIPTION_SECTIONS 顺序拼接非空段落
+    返回新的 dict，不修改入参。
+    """
+    desc = dict(description)
+
+    condition_key = desc.get("conditionKey")
+    if condition_key:
+        tpl = catalog.get("condition", condition_key)
+        if tpl:
+            if not desc.get("conditionDescription"):
+                desc["conditionDescription"] = tpl.get("text", "")
+            template_notice = tpl.get("buyerNotice", "")
+            if template_notice and template_notice not in desc.get("buyerNotice", ""):
+                desc["buyerNotice"] = _join(template_notice, desc.get("buyerNotice", ""))
+
+    brand_key = desc.get("brandKey")
+    if brand_key and not desc.get("brandNotice"):
+        tpl = catalog.get("brand", brand_key)
+        if tpl:
+            desc["brandNotice"] = tpl.get("text", "")
+
+    for key in desc.get("buyerKeys") or []:
+        tpl = catalog.get("buyer", key)
+        if tpl and tpl.get("text") and tpl["text"] not in desc.get("buyerNotice", ""):
+            desc["buyerNotice"] = _join(desc.get("buyerNotice", ""), tpl["text"])
+
+    desc["text"] = "\n\n".join(
+        f"{title}:\n{str(desc[name]).strip()}"
+        for name, title in DESCRIPTION_SECTIONS
+        if str(desc.get(name) or "").strip()
+    )
+    return desc
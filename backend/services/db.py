@@ -1,16 +1,112 @@
 # backend/services/db.py
 
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
 from pymongo import MongoClient
-from config import MONGO_URI
+from pymongo.errors import OperationFailure
+from config import (
+    MONGO_URI,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_ANALYTICS_URI,
+    MONGO_ANALYTICS_MAX_POOL_SIZE,
+    MONGO_ANALYTICS_MAX_STALENESS_SECONDS,
+    MONGO_ANALYTICS_SOCKET_TIMEOUT_MS,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+# MongoClient 不是 fork 安全的：必须在每个 worker 进程 fork 之后再创建。
+# 这里不在导入时建连接，而是首次使用（或 lifespan 启动）时按进程懒加载。
+#
+# 读写分离：
+# - "primary"：队列写操作（/next 的 find_one_and_update 等），读主节点
+# - "analytics"：统计/导出等重查询，secondaryPreferred + 独立连接池，
+#   不与录货员的领取操作抢主节点和连接。单节点副本集/standalone 时自动退化为读主节点。
+PRIMARY = "primary"
+ANALYTICS = "analytics"
+
+_clients: Dict[str, MongoClient] = {}
+_clients_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def _create_client(role: str) -> MongoClient:
+    if role == ANALYTICS:
+        return MongoClient(
+            MONGO_ANALYTICS_URI or MONGO_URI,
+            readPreference="secondaryPreferred",
+            maxStalenessSeconds=MONGO_ANALYTICS_MAX_STALENESS_SECONDS,
+            maxPoolSize=MONGO_ANALYTICS_MAX_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_ANALYTICS_SOCKET_TIMEOUT_MS,
+        )
+    return MongoClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    )
+
+
+def get_client(role: str = PRIMARY) -> MongoClient:
+    """
+    返回当前进程指定角色的 MongoClient，不存在时创建。
+    若检测到 pid 变化（父进程 fork 出的 worker 继承了旧连接），丢弃旧实例重新创建。
+    """
+    global _clients_pid
+    pid = os.getpid()
+    client = _clients.get(role)
+    if client is not None and _clients_pid == pid:
+        return client
+    with _client_lock:
+        if _clients_pid != pid:
+            # 继承自父进程的连接不能用，也不能 close（会影响父进程），直接丢弃
+            _clients.clear()
+            _clients_pid = pid
+        if role not in _clients:
+            _clients[role] = _create_client(role)
+        return _clients[role]
+
+
+def connect_db() -> MongoClient:
+    """
+    在 app lifespan 启动时调用：为本 worker 打开连接池并 ping 一次验证连通性。
+    连接失败时抛出 pymongo 的异常，由调用方决定如何处理。
+    分析连接池按需懒加载，不参与启动检查。
+    """
+    client = get_client(PRIMARY)
+    client.admin.command("ping")
+    return client
 
-# 创建 MongoDB 客户端连接
-client = MongoClient(MONGO_URI)
 
-# 指定数据库名称
-db = client["QCsys"]
+def close_db() -> None:
+    """在 app lifespan 结束时调用，关闭本进程的所有连接池。"""
+    global _clients_pid
+    with _client_lock:
+        if _clients_pid == os.getpid():
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+        _clients_pid = None
+
+
+def ping_db() -> bool:
+    """就绪探针使用：主连接能 ping 通返回 True，否则 False。"""
+    try:
+        get_client(PRIMARY).admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+def get_db(role: str = PRIMARY):
+    """返回业务数据库（默认 QCsys）"""
+    return get_client(role)[MONGO_DB_NAME]
 
-# 显式创建用户集合（用于用户登录验证）
-users_collection = db["userlist"]
 
 # 通用函数：根据集合名获取集合对象
 def get_collection(name: str):
@@ -18,4 +114,38 @@ def get_collection(name: str):
     根据集合名称返回指定集合（表）
     用法：get_collection("qa_bot") 或 get_collection("check_done")
     """
-    return db[name]
\ No newline at end of file
+    return get_db()[name]
+
+
+def get_analytics_collection(name: str):
+    """
+    返回走分析连接池（secondaryPreferred）的集合，仅用于只读统计/导出查询。
+    读到的数据可能落后主节点最多 maxStalenessSeconds 秒。
+    """
+    return get_db(ANALYTICS)[name]
+
+
+# 用户集合（用于用户登录验证）
+def get_users_collection():
+    return get_collection("userlist")
+
+
+def ensure_indexes() -> None:
+    """
+    在 app lifespan 启动时调用，创建业务集合的索引（已存在时为空操作）：
+    - qa_bot (session, label, number) 唯一：QC 提交按该键 upsert 去重，也用于 /api/qc/lookup 覆盖查询
+    - check_done (Session, Label, Number)：重复检测和 lookup 的覆盖查询
+    已有重复数据时唯一索引会创建失败，只记日志，清理后重启即可。
+    """
+    try:
+        get_collection("qa_bot").create_index(
+            [("session", 1), ("label", 1), ("number", 1)],
+            unique=True,
+            name="session_label_number_unique",
+        )
+    except OperationFailure:
+        logger.exception("qa_bot 唯一索引创建失败，请先清理重复的 (session, label, number)")
+    get_collection("check_done").create_index(
+        [("Session", 1), ("Label", 1), ("Number", 1)],
+        name="session_label_number",
+    )
@@ -0,0 +1,138 @@
+# backend/services/event_log.py
+"""
+记录生命周期事件日志（record_events 集合）。
+
+路由只把事件追加到进程内缓冲区，后台任务每 EVENT_FLUSH_INTERVAL_MS 毫秒用一次
+insert_many 批量写入，请求路径不等待日志写库。集合按 at 字段建 TTL 索引，
+超过 EVENT_TTL_DAYS 天的事件自动删除。
+
+事件类型：
+- claim：/next 领取（durationMs 无）
+- expired：/next 接手了别人已过期的锁，user 为原持有人
+- renew / renew_failed：/renew 续租成功 / 失败（锁已丢失）
+- unlock / skip
+- submit：durationMs 为从领取到提交的耗时
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+from config import EVENT_FLUSH_INTERVAL_MS, EVENT_TTL_DAYS, EVENT_BUFFER_MAX
+from services.db import get_collection
+
+logger = logging.getLogger("uvicorn.error")
+
+COLLECTION = "record_events"
+
+EVENT_TYPES = {"claim", "expired", "renew", "renew_failed", "unlock", "skip", "submit"}
+
+
+class EventLog:
+    def __init__(
+        self,
+        flush_interval_ms: int = EVENT_FLUSH_INTERVAL_MS,
+        max_buffer: int = EVENT_BUFFER_MAX,
+    ):
+        self.flush_interval = max(10, flush_interval_ms) / 1000
+        # 同步路由在线程池里调用 record，用线程锁保护；超过上限时丢弃最旧的事件
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        event: str,
+        record_id: Any,
+        user: Optional[str],
+        session: Optional[str] = None,
+        **extra: Any,
+    ) -> None:
+        """追加一条事件，立即返回"""
+        doc = {
+            "event": event,
+            "recordId": str(record_id),
+            "user": user,
+            "session": session,
+            "at": datetime.now(timezone.utc),
+            **extra,
+        }
+        with self._lock:
+            self._buffer.append(doc)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+        return batch
+
+    def flush(self) -> int:
+        """把缓冲区写入数据库（阻塞），返回写入条数；写入失败时放回缓冲区"""
+        batch = self._drain()
+        if not batch:
+            return 0
+        try:
+            get_collection(COLLECTION).insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # insert_many 已给每条事件补上 _id：E11000 说明上次重试前其实已写入，视为成功；
+            # 只把真正失败的事件放回缓冲区
+            failed = [
+                batch[err["index"]]
+                for err in e.details.get("writeErrors", [])
+                if err.get("code") != 11000
+            ]
+            if failed:
+                logger.error("写入 record_events 部分失败（%d/%d 条），稍后重试", len(failed), len(batch))
+                self._requeue(failed)
+            return len(batch) - len(failed)
+        except Exception:
+            # 连接错误等：不确定服务端是否已写入，整批放回；重试时已写入的会按 E11000 跳过
+            logger.exception("写入 record_events 失败（%d 条），稍后重试", len(batch))
+            self._requeue(batch)
+            return 0
+        return len(batch)
+
+    def _requeue(self, docs: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._buffer.extendleft(reversed(docs))
+
+    # ---------- 生命周期（在 app lifespan 中调用） ----------
+    async def start(self) -> None:
+        if self._task is None:
+            try:
+                await run_in_threadpool(ensure_indexes)
+            except Exception:
+                logger.exception("创建 record_events 索引失败")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 退出前把剩余事件写完
+        await run_in_threadpool(self.flush)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                await run_in_threadpool(self.flush)
+
+
+def ensure_indexes() -> None:
+    coll = get_collection(COLLECTION)
+    coll.create_index("at", expireAfterSeconds=EVENT_TTL_DAYS * 24 * 3600)
+    coll.create_index([("event", 1), ("at", 1)])
+
+
+# 进程内单例；刷新任务在 app lifespan 中启动
+event_log = EventLog()
@@ -0,0 +1,494 @@
+# backend/services/image_handler.py
+"""
+图片存储抽象。
+
+路由只通过 ImageStorage 的异步方法访问图片，不再直接调用 os / pathlib：
+- LocalStorage：本地目录，所有阻塞 I/O 放到有界线程池（IMAGE_IO_THREADS）执行，不阻塞事件循环
+- S3Storage：S3 兼容对象存储（AWS S3 / MinIO），需要安装 boto3
+
+key 统一使用 "/" 分隔的相对路径，例如 "SSN122/1130/1130-1.jpg"。
+两个图片根目录各对应一个存储实例：
+- record_images：录货图片（原 IMAGE_ROOT）
+- qc_images：质检上传图片（原 UPLOAD_BASE）
+
+本地存储按内容去重（IMAGE_DEDUP=1）：写入时边拷贝边计算 SHA-256，内容只在 BLOB_ROOT 下存一份
+（{sha[:2]}/{sha[2:4]}/{sha}），{session}/{number}/{name} 是指向它的硬链接。
+引用计数即文件系统的硬链接数：删除最后一个引用时一并删除 blob。
+相同内容的多个路径共享同一个 inode，节省的是磁盘空间；浏览器按 URL 缓存，不同路径下的相同图片仍各自下载一次。
+BLOB_ROOT 与图片根目录不在同一分区时（首次写入时检查）关闭去重；其他原因链接失败时退化为普通拷贝。
+"""
+import abc
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Callable, List, Optional, Tuple, Union
+
+from config import (
+    IMAGE_ROOT,
+    UPLOAD_BASE,
+    IMAGE_DEDUP,
+    BLOB_ROOT,
+    IMAGE_STORAGE,
+    IMAGE_IO_THREADS,
+    S3_ENDPOINT_URL,
+    S3_BUCKET,
+    S3_ACCESS_KEY,
+    S3_SECRET_KEY,
+    S3_REGION,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+CHUNK_SIZE = 1024 * 1024
+
+Data = Union[bytes, BinaryIO]
+
+# 所有图片 I/O 共用的有界线程池，避免大量上传/下载占满默认线程池
+_io_pool = ThreadPoolExecutor(max_workers=IMAGE_IO_THREADS, thread_name_prefix="image-io")
+
+
+async def _run_io(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, partial(func, *args, **kwargs))
+
+
+def join_key(*parts: Any) -> str:
+    """拼接 key，拒绝 ".." 等可能越出根目录的片段"""
+    cleaned = []
+    for part in parts:
+        for seg in str(part).replace("\\", "/").split("/"):
+            if seg in ("", "."):
+                continue
+            if seg == "..":
+                raise ValueError("非法路径")
+            cleaned.append(seg)
+    if not cleaned:
+        raise ValueError("非法路径")
+    return "/".join(cleaned)
+
+
+class ImageStorage(abc.ABC):
+    """图片存储接口"""
+
+    @abc.abstractmethod
+    def location(self) -> str:
+        """存储位置标识；两个实例相同表示指向同一批文件（例如 IMAGE_ROOT 与 UPLOAD_BASE 相同）"""
+        ...
+
+    @abc.abstractmethod
+    async def list(self, prefix: str) -> List[str]:
+        """列出 prefix "目录" 下直接包含的文件名（不递归），不存在时返回空列表"""
+        ...
+
+    @abc.abstractmethod
+    def list_sync(self, prefix: str) -> List[str]:
+        """list 的阻塞版本：供已在线程池中运行的同步路由直接调用，不再切回事件循环"""
+        ...
+
+    @abc.abstractmethod
+    async def list_dirs(self, prefix: str) -> List[str]:
+        """列出 prefix "目录" 下的子目录名（不递归）"""
+        ...
+
+    @abc.abstractmethod
+    async def put(self, key: str, data: Data) -> None:
+        """写入（覆盖）一个文件；data 可以是 bytes 或可读的文件对象"""
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> bool:
+        """删除文件，返回删除前是否存在"""
+        ...
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def size(self, key: str) -> int:
+        """文件字节数，不存在时抛 FileNotFoundError"""
+        ...
+
+    @abc.abstractmethod
+    async def stat(self, key: str) -> Tuple[int, float]:
+        """(字节数, 修改时间戳)，不存在时抛 FileNotFoundError"""
+        ...
+
+    @abc.abstractmethod
+    async def open_stream(
+        self, key: str, start: int = 0, length: Optional[int] = None, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        从 start 开始分块读取 length 字节（None 表示读到末尾）。
+        文件不存在时在第一次迭代前抛 FileNotFoundError。
+        """
+        ...
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LocalStorage(ImageStorage):
+    def __init__(self, root: str, blob_root: Optional[str] = None):
+        self.root = Path(root)
+        # 为 None 时不去重，直接写文件
+        self.blob_root = Path(blob_root) if blob_root else None
+        self._device_checked = False
+
+    def location(self) -> str:
+        return os.path.normcase(str(self.root.resolve()))
+
+    def _path(self, key: str) -> Path:
+        return self.root / join_key(key)
+
+    def _list(self, prefix: str) -> List[str]:
+        folder = self._path(prefix)
+        if not folder.is_dir():
+            return []
+        # 以 "." 开头的是写入中的临时链接或 blob 目录
+        return [f.name for f in folder.iterdir() if f.is_file() and not f.name.startswith(".")]
+
+    def _list_dirs(self, prefix: str) -> List[str]:
+        folder = self._path(prefix)
+        if not folder.is_dir():
+            return []
+        return [f.name for f in folder.iterdir() if f.is_dir() and not f.name.startswith(".")]
+
+    # ---------- 内容寻址 ----------
+    def _blob_path(self, sha: str) -> Path:
+        return self.blob_root / sha[:2] / sha[2:4] / sha
+
+    def _write_temp(self, data: Data) -> Tuple[Path, str]:
+        """写入 blob 目录下的临时文件，同时计算 SHA-256"""
+        tmp_dir = self.blob_root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        with os.fdopen(fd, "wb") as out:
+            if isinstance(data, (bytes, bytearray)):
+                h.update(data)
+                out.write(data)
+            else:
+                for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    out.write(chunk)
+        return Path(tmp), h.hexdigest()
+
+    def _release(self, path: Path) -> None:
+        """
+        path 即将被删除/覆盖：若它和 blob 是该内容仅剩的两个链接，删除 blob
+        """
+        if self.blob_root is None:
+            return
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return
+        if st.st_nlink != 2:
+            return
+        blob = self._blob_path(_sha256_file(path))
+        try:
+            bst = blob.stat()
+        except FileNotFoundError:
+            return
+        if (bst.st_dev, bst.st_ino) == (st.st_dev, st.st_ino):
+            os.remove(blob)
+
+    def _check_device(self) -> None:
+        """首次写入时检查一次：BLOB_ROOT 与图片根目录不在同一分区时无法硬链接，关闭去重"""
+        if self._device_checked or self.blob_root is None:
+            return
+        self._device_checked = True
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.blob_root.mkdir(parents=True, exist_ok=True)
+        if self.root.stat().st_dev != self.blob_root.stat().st_dev:
+            logger.warning("BLOB_ROOT %s 与 %s 不在同一分区，已关闭图片去重", self.blob_root, self.root)
+            self.blob_root = None
+
+    def _put(self, key: str, data: Data) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._check_device()
+        if self.blob_root is None:
+            with open(path, "wb") as out:
+                if isinstance(data, (bytes, bytearray)):
+                    out.write(data)
+                else:
+                    shutil.copyfileobj(data, out, CHUNK_SIZE)
+            return
+
+        tmp, sha = self._write_temp(data)
+        link_tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            blob = self._blob_path(sha)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            created = False
+            try:
+                os.link(tmp, blob)  # 新内容入库；已存在则复用
+                created = True
+            except FileExistsError:
+                pass
+            try:
+                os.link(blob, link_tmp)
+            except OSError:
+                # 不支持硬链接或 blob 刚被并发删除：退化为普通拷贝。
+                # 刚建的 blob 此时只有 tmp 一个其他链接，没有引用会释放它，需一并删除
+                if created and blob.stat().st_nlink == 2:
+                    os.remove(blob)
+                shutil.copyfile(tmp, link_tmp)
+            # 不能直接覆盖写旧文件（会改动所有共享该 inode 的路径），先释放再原子替换
+            self._release(path)
+            os.replace(link_tmp, path)
+        finally:
+            for leftover in (tmp, link_tmp):
+                try:
+                    os.remove(leftover)
+                except FileNotFoundError:
+                    pass
+
+    def _delete(self, key: str) -> bool:
+        path = self._path(key)
+        try:
+            self._release(path)
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _size(self, key: str) -> int:
+        path = self._path(key)
+        if not path.is_file():
+            raise FileNotFoundError(key)
+        return path.stat().st_size
+
+    def _stat(self, key: str) -> Tuple[int, float]:
+        path = self._path(key)
+        if not path.is_file():
+            raise FileNotFoundError(key)
+        st = path.stat()
+        return st.st_size, st.st_mtime
+
+    async def list(self, prefix: str) -> List[str]:
+        return await _run_io(self._list, prefix)
+
+    def list_sync(self, prefix: str) -> List[str]:
+        return self._list(prefix)
+
+    async def list_dirs(self, prefix: str) -> List[str]:
+        return await _run_io(self._list_dirs, prefix)
+
+    async def put(self, key: str, data: Data) -> None:
+        await _run_io(self._put, key, data)
+
+    async def delete(self, key: str) -> bool:
+        return await _run_io(self._delete, key)
+
+    async def exists(self, key: str) -> bool:
+        return await _run_io(self._path(key).is_file)
+
+    async def size(self, key: str) -> int:
+        return await _run_io(self._size, key)
+
+    async def stat(self, key: str) -> Tuple[int, float]:
+        return await _run_io(self._stat, key)
+
+    async def open_stream(
+        self, key: str, start: int = 0, length: Optional[int] = None, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        path = self._path(key)
+        f = await _run_io(open, path, "rb")
+
+        async def _iter() -> AsyncIterator[bytes]:
+            try:
+                if start:
+                    await _run_io(f.seek, start)
+                remaining = length
+                while remaining is None or remaining > 0:
+                    n = chunk_size if remaining is None else min(chunk_size, remaining)
+                    chunk = await _run_io(f.read, n)
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+            finally:
+                await _run_io(f.close)
+
+        return _iter()
+
+
+class S3Storage(ImageStorage):
+    """
+    S3 兼容存储。endpoint_url 指向 MinIO 等本地服务即可在本机测试。
+    boto3 客户端按进程懒加载（fork 之后创建）。
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", **client_kwargs: Any):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._client_pid: Optional[int] = None
+
+    @property
+    def client(self):
+        if self._client is None or self._client_pid != os.getpid():
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("IMAGE_STORAGE=s3 需要安装 boto3")
+            self._client = boto3.client("s3", **self._client_kwargs)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def location(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def _key(self, key: str) -> str:
+        key = join_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def _is_missing(err: Exception) -> bool:
+        code = getattr(err, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def _list(self, prefix: str) -> List[str]:
+        full = self._key(prefix) + "/"
+        names: List[str] = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full, Delimiter="/"):
+            for obj in page.get("Contents", []):
+                names.append(obj["Key"][len(full):])
+        return names
+
+    def _list_dirs(self, prefix: str) -> List[str]:
+        full = self._key(prefix) + "/"
+        names: List[str] = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full, Delimiter="/"):
+            for cp in page.get("CommonPrefixes", []):
+                names.append(cp["Prefix"][len(full):].rstrip("/"))
+        return names
+
+    def _put(self, key: str, data: Data) -> None:
+        if isinstance(data, (bytes, bytearray)):
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=bytes(data))
+        else:
+            self.client.upload_fileobj(data, self.bucket, self._key(key))
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def _delete(self, key: str) -> bool:
+        if self._head(key) is None:
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def _size(self, key: str) -> int:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head["ContentLength"]
+
+    def _stat(self, key: str) -> Tuple[int, float]:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def _get_body(self, key: str, start: int, length: Optional[int]):
+        kwargs = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or length is not None:
+            end = "" if length is None else str(start + length - 1)
+            kwargs["Range"] = f"bytes={start}-{end}"
+        try:
+            return self.client.get_object(**kwargs)["Body"]
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    async def list(self, prefix: str) -> List[str]:
+        return await _run_io(self._list, prefix)
+
+    def list_sync(self, prefix: str) -> List[str]:
+        return self._list(prefix)
+
+    async def list_dirs(self, prefix: str) -> List[str]:
+        return await _run_io(self._list_dirs, prefix)
+
+    async def put(self, key: str, data: Data) -> None:
+        await _run_io(self._put, key, data)
+
+    async def delete(self, key: str) -> bool:
+        return await _run_io(self._delete, key)
+
+    async def exists(self, key: str) -> bool:
+        return await _run_io(self._head, key) is not None
+
+    async def size(self, key: str) -> int:
+        return await _run_io(self._size, key)
+
+    async def stat(self, key: str) -> Tuple[int, float]:
+        return await _run_io(self._stat, key)
+
+    async def open_stream(
+        self, key: str, start: int = 0, length: Optional[int] = None, chunk_size: int = CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        if length == 0:
+            async def _empty() -> AsyncIterator[bytes]:
+                return
+                yield b""
+            return _empty()
+        body = await _run_io(self._get_body, key, start, length)
+
+        async def _iter() -> AsyncIterator[bytes]:
+            try:
+                while True:
+                    chunk = await _run_io(body.read, chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                await _run_io(body.close)
+
+        return _iter()
+
+
+def create_storage(root: str, s3_prefix: str) -> ImageStorage:
+    if IMAGE_STORAGE == "s3":
+        return S3Storage(
+            S3_BUCKET,
+            prefix=s3_prefix,
+            endpoint_url=S3_ENDPOINT_URL or None,
+            aws_access_key_id=S3_ACCESS_KEY or None,
+            aws_secret_access_key=S3_SECRET_KEY or None,
+            region_name=S3_REGION or None,
+        )
+    if IMAGE_STORAGE != "local":
+        raise ValueError(f"未知的图片存储类型: {IMAGE_STORAGE}")
+    return LocalStorage(root, blob_root=BLOB_ROOT if IMAGE_DEDUP else None)
+
+
+# 录货图片（原 IMAGE_ROOT）和质检图片（原 UPLOAD_BASE）
+record_images = create_storage(IMAGE_ROOT, "record")
+qc_images = create_storage(UPLOAD_BASE, "qc")
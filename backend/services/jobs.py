@@ -0,0 +1,39 @@
+# backend/services/jobs.py
+"""
+后台任务定义。main.py 导入本模块完成注册；路由通过 task_queue.enqueue 入队。
+"""
+import logging
+import os
+from typing import Any, Dict
+
+from config import THUMBNAIL_SIZE
+from services.image_handler import record_images, join_key
+from services.task_queue import task, task_queue
+from utils.image_compression import make_thumbnail
+
+logger = logging.getLogger("uvicorn.error")
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+@task("thumbnails", executor="async", concurrency=2)
+async def generate_thumbnails(payload: Dict[str, Any]) -> None:
+    """
+    为 {session}/{number} 下的图片生成缩略图，写到 {session}/{number}/thumbs/{name}.jpg。
+    读写走图片存储，缩放放到进程池执行；已存在的缩略图跳过，重试时幂等。
+    """
+    folder = join_key(payload["session"], payload["number"])
+    for name in await record_images.list(folder):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTS:
+            continue
+        thumb_key = f"{folder}/thumbs/{os.path.splitext(name)[0]}.jpg"
+        if await record_images.exists(thumb_key):
+            continue
+        data = b"".join([chunk async for chunk in await record_images.open_stream(f"{folder}/{name}")])
+        try:
+            thumb = await task_queue.run_in_process(make_thumbnail, data, THUMBNAIL_SIZE)
+        except Exception:
+            # 单张图片损坏不影响其他图片
+            logger.exception("缩略图生成失败: %s/%s", folder, name)
+            continue
+        await record_images.put(thumb_key, thumb)
@@ -0,0 +1,167 @@
+# backend/services/lease_tracker.py
+"""
+锁续租合并写入。
+
+/renew 每 150 秒一次、每次一条 update_one，只为更新 lockedAt。这里在进程内维护一张租约表：
+- 本进程确认过（/next 领取或一次成功的数据库续租）的锁，续租时只在内存里记下新的 lockedAt 并立即返回
+- 后台任务每 LEASE_FLUSH_INTERVAL_SECONDS 秒把所有待写的 lockedAt 用一次无序 bulk_write 写回，
+  每条更新仍带 {locked: True, lockedBy: user} 条件，绝不会覆盖别人的锁
+- 没有命中的更新说明锁已丢失（被解锁/跳过/提交），从表中移除，下一次续租走数据库并返回 403
+
+租约表里的记录只在"数据库最近一次确认"后 trust_seconds 内有效（远小于 LOCK_TIMEOUT_SECONDS），
+过期后续租会回退到直接写库。多 worker 下续租请求落到别的进程时，该进程同样走数据库校验。
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+
+from config import LOCK_TIMEOUT_SECONDS, LEASE_FLUSH_INTERVAL_SECONDS
+from services.db import get_collection
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@dataclass
+class Lease:
+    user: Optional[str]
+    confirmed_at: float               # 数据库最近一次确认持有锁的时间（monotonic）
+    pending: Optional[datetime] = None  # 尚未写回的 lockedAt
+
+
+class LeaseTracker:
+    def __init__(
+        self,
+        lock_timeout_seconds: int = LOCK_TIMEOUT_SECONDS,
+        flush_interval_seconds: float = LEASE_FLUSH_INTERVAL_SECONDS,
+    ):
+        # 写回间隔必须远小于锁超时，否则数据库里的 lockedAt 可能在写回前就被判定过期
+        max_interval = lock_timeout_seconds / 4
+        if flush_interval_seconds > max_interval:
+            logger.warning(
+                "LEASE_FLUSH_INTERVAL_SECONDS=%s 过大，已调整为 %s", flush_interval_seconds, max_interval
+            )
+            flush_interval_seconds = max_interval
+        self.flush_interval = flush_interval_seconds
+        # 内存租约最多信任这么久；留出两个写回周期的余量
+        self.trust_seconds = lock_timeout_seconds - 2 * flush_interval_seconds
+        self._leases: Dict[ObjectId, Lease] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, rid: ObjectId, user: Optional[str]) -> None:
+        """数据库已确认 user 持有 rid 的锁（领取或直接续租成功后调用）"""
+        with self._lock:
+            self._leases[rid] = Lease(user=user, confirmed_at=time.monotonic())
+
+    def forget(self, rid: ObjectId) -> None:
+        """解锁/跳过/提交后调用"""
+        with self._lock:
+            self._leases.pop(rid, None)
+
+    def renew(self, rid: ObjectId, user: Optional[str], now: datetime) -> bool:
+        """
+        尝试在内存中续租。返回 True 表示已受理（稍后批量写回）；
+        False 表示本进程无法确认所有权，调用方需直接写库校验。
+        """
+        with self._lock:
+            lease = self._leases.get(rid)
+            if lease is None or lease.user != user:
+                return False
+            if time.monotonic() - lease.confirmed_at > self.trust_seconds:
+                return False
+            lease.pending = now
+            return True
+
+    def flush(self) -> int:
+        """清除过期租约，并把待写回的 lockedAt 批量写入（阻塞），返回写入条数"""
+        with self._lock:
+            # 超过信任期的租约已无用（锁在别的进程被提交/解锁，或被放弃），直接清除，避免租约表无限增长
+            stale_before = time.monotonic() - self.trust_seconds
+            for rid in [
+                rid for rid, lease in self._leases.items()
+                if lease.pending is None and lease.confirmed_at < stale_before
+            ]:
+                del self._leases[rid]
+            batch: List[Tuple[ObjectId, Optional[str], datetime]] = [
+                (rid, lease.user, lease.pending)
+                for rid, lease in self._leases.items()
+                if lease.pending is not None
+            ]
+            for rid, _, _ in batch:
+                self._leases[rid].pending = None
+        if not batch:
+            return 0
+
+        coll = get_collection("qa_bot")
+        flushed_at = time.monotonic()
+        try:
+            res = coll.bulk_write(
+                [
+                    UpdateOne({"_id": rid, "locked": True, "lockedBy": user}, {"$set": {"lockedAt": at}})
+                    for rid, user, at in batch
+                ],
+                ordered=False,
+            )
+        except Exception:
+            logger.exception("批量续租写回失败（%d 条），下个周期重试", len(batch))
+            with self._lock:
+                for rid, _, at in batch:
+                    lease = self._leases.get(rid)
+                    if lease is not None and lease.pending is None:
+                        lease.pending = at
+            return 0
+
+        lost = set()
+        if res.matched_count < len(batch):
+            # 有锁已丢失：查出仍由本人持有的，其余从租约表移除
+            owners = {
+                doc["_id"]: doc.get("lockedBy")
+                for doc in coll.find(
+                    {"_id": {"$in": [rid for rid, _, _ in batch]}, "locked": True},
+                    {"lockedBy": 1},
+                )
+            }
+            lost = {rid for rid, user, _ in batch if owners.get(rid) != user}
+        with self._lock:
+            for rid, user, _ in batch:
+                lease = self._leases.get(rid)
+                if lease is None or lease.user != user:
+                    continue
+                if rid in lost:
+                    del self._leases[rid]
+                else:
+                    lease.confirmed_at = flushed_at
+        return len(batch) - len(lost)
+
+    # ---------- 生命周期（在 app lifespan 中调用） ----------
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 退出前写回剩余续租，避免锁因进程重启而过期
+        await run_in_threadpool(self.flush)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await run_in_threadpool(self.flush)
+
+
+# 进程内单例；写回任务在 app lifespan 中启动
+lease_tracker = LeaseTracker()
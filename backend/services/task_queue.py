@@ -0,0 +1,353 @@
+# backend/services/task_queue.py
+"""
+持久化的进程内后台任务队列。
+
+- 任务存放在 MongoDB jobs 集合：路由调用 enqueue 写入一条后立即返回
+- 每个 worker 进程在 app lifespan 中启动 TASK_WORKERS 个协程，按 runAt 抢占式领取任务：
+  find_one_and_update 设置 status=running 和 leaseUntil（租约），执行期间定期续租；
+  进程崩溃后租约过期，其他进程会重新领取
+- 失败按指数退避重试，超过 max_attempts 标记为 failed；执行中让进程崩溃的任务同样计次，
+  用尽后不再被领取，空闲 worker 定期把它们标记为 failed
+- 每种任务可设置本进程内的并发上限，以及执行方式：
+  async（协程）、thread（线程池执行同步函数）、process（进程池执行可 pickle 的模块级函数）
+- 已完成的任务保留 TASK_RETENTION_DAYS 天后由 TTL 索引删除
+
+注册任务：
+
+    @task("thumbnails", executor="async", concurrency=2)
+    async def make_thumbnails(payload): ...
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from starlette.concurrency import run_in_threadpool
+
+from config import (
+    TASK_WORKERS,
+    TASK_POLL_INTERVAL_MS,
+    TASK_LEASE_SECONDS,
+    TASK_THREAD_POOL,
+    TASK_PROCESS_POOL,
+    TASK_RETENTION_DAYS,
+)
+from services.db import get_collection
+
+logger = logging.getLogger("uvicorn.error")
+
+COLLECTION = "jobs"
+
+EXECUTORS = ("async", "thread", "process")
+
+
+@dataclass
+class TaskSpec:
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    executor: str = "async"
+    concurrency: int = 1
+    max_attempts: int = 3
+    retry_base_seconds: float = 5.0
+
+
+_registry: Dict[str, TaskSpec] = {}
+
+
+def task(
+    name: str,
+    executor: str = "async",
+    concurrency: int = 1,
+    max_attempts: int = 3,
+    retry_base_seconds: float = 5.0,
+):
+    """注册任务处理函数（装饰器），处理函数接收 payload dict"""
+    if executor not in EXECUTORS:
+        raise ValueError(f"未知的执行方式: {executor}")
+
+    def decorator(func: Callable[[Dict[str, Any]], Any]):
+        _registry[name] = TaskSpec(
+            name=name,
+            func=func,
+            executor=executor,
+            concurrency=max(1, concurrency),
+            max_attempts=max(1, max_attempts),
+            retry_base_seconds=retry_base_seconds,
+        )
+        return func
+
+    return decorator
+
+
+def enqueue(name: str, payload: Optional[Dict[str, Any]] = None, delay_seconds: float = 0) -> str:
+    """
+    写入一条任务，返回任务 ID（阻塞调用，async 路由中请放到线程池执行）
+    """
+    if name not in _registry:
+        raise ValueError(f"未注册的任务类型: {name}")
+    now = datetime.now(timezone.utc)
+    spec = _registry[name]
+    res = get_collection(COLLECTION).insert_one({
+        "type": name,
+        "payload": payload or {},
+        "status": "queued",
+        "attempts": 0,
+        "maxAttempts": spec.max_attempts,
+        "runAt": now + timedelta(seconds=delay_seconds),
+        "createdAt": now,
+        "updatedAt": now,
+    })
+    task_queue.notify()
+    return str(res.inserted_id)
+
+
+def ensure_indexes() -> None:
+    coll = get_collection(COLLECTION)
+    coll.create_index([("status", 1), ("type", 1), ("runAt", 1)])
+    coll.create_index("finishedAt", expireAfterSeconds=TASK_RETENTION_DAYS * 24 * 3600)
+
+
+def queue_depth() -> List[Dict[str, Any]]:
+    """按任务类型和状态统计数量（done 由 TTL 清理，不计入）"""
+    pipeline = [
+        {"$match": {"status": {"$in": ["queued", "running", "failed"]}}},
+        {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}},
+    ]
+    depth: Dict[str, Dict[str, int]] = {}
+    for row in get_collection(COLLECTION).aggregate(pipeline):
+        item = depth.setdefault(row["_id"]["type"], {"queued": 0, "running": 0, "failed": 0})
+        item[row["_id"]["status"]] = row["count"]
+    return [{"type": t, **counts} for t, counts in sorted(depth.items())]
+
+
+class TaskQueue:
+    def __init__(
+        self,
+        workers: int = TASK_WORKERS,
+        poll_interval_ms: int = TASK_POLL_INTERVAL_MS,
+        lease_seconds: int = TASK_LEASE_SECONDS,
+    ):
+        self.workers = workers
+        self.poll_interval = max(50, poll_interval_ms) / 1000
+        self.lease_seconds = lease_seconds
+        self.worker_id = ""
+        self._running: Dict[str, int] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._claim_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_sweep = 0.0
+
+    # ---------- 执行器（fork 之后懒加载） ----------
+    def _threads(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=TASK_THREAD_POOL, thread_name_prefix="task")
+        return self._thread_pool
+
+    def _processes(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # uvicorn worker 里已有 image-io、anyio 和 pymongo 监控线程，fork 会继承它们持有的锁；
+            # 用 spawn 启动干净的子进程（任务函数需可 pickle，Windows 上本来就是 spawn）
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=TASK_PROCESS_POOL, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._process_pool
+
+    async def run_in_process(self, func: Callable, *args: Any) -> Any:
+        """供 async 任务把 CPU 密集的步骤交给进程池（func 需可 pickle）"""
+        return await asyncio.get_running_loop().run_in_executor(self._processes(), func, *args)
+
+    # ---------- 生命周期（在 app lifespan 中调用） ----------
+    async def start(self) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        try:
+            await run_in_threadpool(ensure_indexes)
+        except Exception:
+            logger.exception("创建 jobs 索引失败")
+        # fork 之后才确定 pid
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            try:
+                await t
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._loop = None
+        # 正在执行的任务被取消后租约会过期，由其他进程或下次启动重新执行
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def notify(self) -> None:
+        """本进程刚入队任务时唤醒空闲 worker，无需等待下一个轮询周期（可在任意线程调用）"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    # ---------- 领取与执行 ----------
+    def _available_types(self) -> List[str]:
+        return [
+            name for name, spec in _registry.items()
+            if self._running.get(name, 0) < spec.concurrency
+        ]
+
+    def _claim(self, types: List[str]) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        return get_collection(COLLECTION).find_one_and_update(
+            {
+                "type": {"$in": types},
+                "runAt": {"$lte": now},
+                "$or": [
+                    {"status": "queued"},
+                    # 执行者已失联；重试次数用尽的不再领取（多半是任务本身让进程崩溃），由 _sweep_exhausted 标记失败
+                    {
+                        "status": "running",
+                        "leaseUntil": {"$lt": now},
+                        "$expr": {"$lt": ["$attempts", "$maxAttempts"]},
+                    },
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "leaseUntil": now + timedelta(seconds=self.lease_seconds),
+                    "leasedBy": self.worker_id,
+                    "updatedAt": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("runAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _sweep_exhausted(self) -> int:
+        """把租约已过期且重试次数用尽的任务标记为 failed，使其出现在 /api/stats/jobs 中"""
+        now = datetime.now(timezone.utc)
+        res = get_collection(COLLECTION).update_many(
+            {
+                "status": "running",
+                "leaseUntil": {"$lt": now},
+                "$expr": {"$gte": ["$attempts", "$maxAttempts"]},
+            },
+            {
+                "$set": {"status": "failed", "error": "执行中进程退出，重试次数已用尽", "updatedAt": now},
+                "$unset": {"leaseUntil": "", "leasedBy": ""},
+            },
+        )
+        if res.modified_count:
+            logger.warning("%d 个任务因执行进程反复退出被标记为 failed", res.modified_count)
+        return res.modified_count
+
+    def _extend_lease(self, job_id: Any) -> None:
+        now = datetime.now(timezone.utc)
+        get_collection(COLLECTION).update_one(
+            {"_id": job_id, "status": "running", "leasedBy": self.worker_id},
+            {"$set": {"leaseUntil": now + timedelta(seconds=self.lease_seconds), "updatedAt": now}},
+        )
+
+    def _finish(self, job: Dict[str, Any], error: Optional[str]) -> None:
+        now = datetime.now(timezone.utc)
+        spec = _registry.get(job["type"])
+        if error is None:
+            update = {"status": "done", "finishedAt": now, "updatedAt": now}
+            unset = {"leaseUntil": "", "leasedBy": "", "error": ""}
+        elif spec is not None and job["attempts"] < job.get("maxAttempts", spec.max_attempts):
+            backoff = spec.retry_base_seconds * (2 ** (job["attempts"] - 1))
+            update = {"status": "queued", "runAt": now + timedelta(seconds=backoff), "error": error, "updatedAt": now}
+            unset = {"leaseUntil": "", "leasedBy": ""}
+        else:
+            update = {"status": "failed", "error": error, "updatedAt": now}
+            unset = {"leaseUntil": "", "leasedBy": ""}
+        get_collection(COLLECTION).update_one(
+            {"_id": job["_id"], "leasedBy": self.worker_id},
+            {"$set": update, "$unset": unset},
+        )
+
+    async def _heartbeat(self, job_id: Any) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await run_in_threadpool(self._extend_lease, job_id)
+            except Exception:
+                logger.exception("任务续租失败: %s", job_id)
+
+    async def _execute(self, spec: TaskSpec, payload: Dict[str, Any]) -> Any:
+        if spec.executor == "async":
+            return await spec.func(payload)
+        loop = asyncio.get_running_loop()
+        pool = self._threads() if spec.executor == "thread" else self._processes()
+        return await loop.run_in_executor(pool, spec.func, payload)
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        spec = _registry[job["type"]]
+        heartbeat = asyncio.create_task(self._heartbeat(job["_id"]))
+        error = None
+        try:
+            await self._execute(spec, job.get("payload") or {})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("任务执行失败: %s %s", job["type"], job["_id"])
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            heartbeat.cancel()
+            self._running[spec.name] -= 1
+        await run_in_threadpool(self._finish, job, error)
+
+    async def _worker(self) -> None:
+        while True:
+            job = None
+            # 领取串行化，保证按类型的并发上限不会被同时领取的多个协程突破
+            async with self._claim_lock:
+                types = self._available_types()
+                if types:
+                    try:
+                        job = await run_in_threadpool(self._claim, types)
+                    except Exception:
+                        logger.exception("领取任务失败")
+                if job is not None:
+                    self._running[job["type"]] = self._running.get(job["type"], 0) + 1
+            if job is None:
+                if time.monotonic() - self._last_sweep >= self.lease_seconds:
+                    self._last_sweep = time.monotonic()
+                    try:
+                        await run_in_threadpool(self._sweep_exhausted)
+                    except Exception:
+                        logger.exception("清理失联任务失败")
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_job(job)
+
+    # ---------- 指标 ----------
+    def running(self) -> Dict[str, int]:
+        """本进程各任务类型正在执行的数量"""
+        return {name: count for name, count in self._running.items() if count}
+
+
+# 进程内单例；worker 在 app lifespan 中启动
+task_queue = TaskQueue()
@@ -0,0 +1,213 @@
+# backend/services/zip_stream.py
+"""
+边读边生成的 ZIP 流（不落临时文件，内存占用与文件大小无关）。
+
+- 条目一律 STORED（图片本身已压缩，不再重复压缩），数据后跟 data descriptor 写 CRC
+- 所有条目大小已知，因此整个压缩包的字节布局（总长度、每段偏移）在开始前就能算出，
+  可据此支持 HTTP Range 续传：跳过范围之前的段；之后需要用到的 CRC 再补读对应文件计算
+- 总大小或条目数超过 ZIP 限制时自动使用 ZIP64
+- 布局按列出时的大小固定：文件在传输前被删除或变短时抛 ShortReadError 中断响应，
+  不会发出截断后仍"看似完整"的压缩包；ETag 含修改时间，同大小替换后 If-Range 不会拼接新旧内容
+"""
+import hashlib
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from services.image_handler import ImageStorage, CHUNK_SIZE
+
+# 固定的 DOS 时间（1980-01-01 00:00），保证同一内容多次生成的字节完全一致，续传才能拼接
+_DOS_TIME = 0
+_DOS_DATE = (0 << 9) | (1 << 5) | 1
+
+_FLAGS = 0x0008 | 0x0800  # bit3: 使用 data descriptor；bit11: 文件名为 UTF-8
+_U32 = 0xFFFFFFFF
+
+
+class ShortReadError(IOError):
+    """文件比列出时短（传输前被删除或替换）"""
+
+
+@dataclass(frozen=True)
+class ZipEntry:
+    name: str  # 压缩包内路径
+    key: str   # 存储中的 key
+    size: int
+    mtime: float = 0.0  # 列出时的修改时间，参与 ETag
+
+
+class ZipStream:
+    def __init__(self, storage: ImageStorage, entries: List[ZipEntry]):
+        self.storage = storage
+        self.entries = entries
+        self._names = [e.name.encode("utf-8") for e in entries]
+        data_total = sum(e.size for e in entries)
+        name_total = sum(len(n) for n in self._names)
+        # 以最坏情况（非 ZIP64）估算，超出 32 位或条目数超过 65535 时启用 ZIP64
+        self.zip64 = (
+            len(entries) >= 0xFFFF
+            or any(e.size >= _U32 for e in entries)
+            or data_total + 2 * name_total + 92 * len(entries) + 22 >= _U32
+        )
+        self._crc: Dict[int, int] = {}
+        self._offsets: List[int] = []
+        offset = 0
+        for i, e in enumerate(entries):
+            self._offsets.append(offset)
+            offset += self._local_header_len(i) + e.size + self._descriptor_len()
+        self._cd_offset = offset
+        self._cd_size = sum(self._central_header_len(i) for i in range(len(entries)))
+        self.size = self._cd_offset + self._cd_size + self._end_len()
+
+    def etag(self) -> str:
+        """由条目名、大小和修改时间计算，内容不变时保持不变"""
+        h = hashlib.sha1()
+        for e in self.entries:
+            h.update(f"{e.name}\0{e.size}\0{e.mtime}\n".encode("utf-8"))
+        return f'"{h.hexdigest()}"'
+
+    # ---------- 各结构长度 ----------
+    def _local_header_len(self, i: int) -> int:
+        return 30 + len(self._names[i]) + (20 if self.zip64 else 0)
+
+    def _descriptor_len(self) -> int:
+        return 24 if self.zip64 else 16
+
+    def _central_header_len(self, i: int) -> int:
+        return 46 + len(self._names[i]) + (28 if self.zip64 else 0)
+
+    def _end_len(self) -> int:
+        return (56 + 20 + 22) if self.zip64 else 22
+
+    # ---------- 各结构字节 ----------
+    def _version(self) -> int:
+        return 45 if self.zip64 else 20
+
+    def _local_header(self, i: int) -> bytes:
+        name = self._names[i]
+        if self.zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            sizes = (_U32, _U32)
+        else:
+            extra = b""
+            sizes = (0, 0)
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, self._version(), _FLAGS, 0, _DOS_TIME, _DOS_DATE,
+            0, sizes[0], sizes[1], len(name), len(extra),
+        ) + name + extra
+
+    def _descriptor(self, i: int) -> bytes:
+        size = self.entries[i].size
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, self._crc[i], size, size)
+        return struct.pack("<IIII", 0x08074B50, self._crc[i], size, size)
+
+    def _central_header(self, i: int) -> bytes:
+        name = self._names[i]
+        size = self.entries[i].size
+        offset = self._offsets[i]
+        if self.zip64:
+            extra = struct.pack("<HHQQQ", 0x0001, 24, size, size, offset)
+            size32 = offset32 = _U32
+        else:
+            extra = b""
+            size32, offset32 = size, offset
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, self._version(), self._version(), _FLAGS, 0,
+            _DOS_TIME, _DOS_DATE, self._crc[i], size32, size32, len(name), len(extra),
+            0, 0, 0, 0, offset32,
+        ) + name + extra
+
+    def _end(self) -> bytes:
+        count = len(self.entries)
+        if not self.zip64:
+            return struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, count, count, self._cd_size, self._cd_offset, 0
+            )
+        zip64_end_offset = self._cd_offset + self._cd_size
+        record = struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, self._cd_size, self._cd_offset
+        )
+        locator = struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        end = struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, 0xFFFF, 0xFFFF, _U32, _U32, 0
+        )
+        return record + locator + end
+
+    # ---------- 段落布局 ----------
+    def _segments(self) -> List[Tuple[int, int, str, int]]:
+        """按顺序返回 (起始偏移, 长度, 类型, 条目序号)"""
+        segs = []
+        for i, e in enumerate(self.entries):
+            off = self._offsets[i]
+            hl = self._local_header_len(i)
+            segs.append((off, hl, "header", i))
+            segs.append((off + hl, e.size, "data", i))
+            segs.append((off + hl + e.size, self._descriptor_len(), "descriptor", i))
+        segs.append((self._cd_offset, self._cd_size, "central", -1))
+        segs.append((self._cd_offset + self._cd_size, self._end_len(), "end", -1))
+        return segs
+
+    async def _read(self, i: int, start: int, length: int) -> AsyncIterator[bytes]:
+        """读取条目 i 的 [start, start+length)，不足 length 字节时抛 ShortReadError"""
+        key = self.entries[i].key
+        got = 0
+        try:
+            async for chunk in await self.storage.open_stream(
+                key, start=start, length=length, chunk_size=CHUNK_SIZE
+            ):
+                got += len(chunk)
+                yield chunk
+        except FileNotFoundError:
+            raise ShortReadError(f"{key} 已被删除")
+        if got < length:
+            raise ShortReadError(f"{key} 比列出时短 {length - got} 字节")
+
+    async def _ensure_crc(self, i: int) -> None:
+        """补算未完整读取过的条目 CRC（续传时跳过的文件）"""
+        if i in self._crc:
+            return
+        crc = 0
+        async for chunk in self._read(i, 0, self.entries[i].size):
+            crc = zlib.crc32(chunk, crc)
+        self._crc[i] = crc
+
+    async def stream(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        生成 [start, end] 闭区间的字节（默认整个压缩包）。
+        """
+        if end is None:
+            end = self.size - 1
+        for seg_start, seg_len, kind, i in self._segments():
+            seg_end = seg_start + seg_len - 1
+            if seg_len == 0 or seg_end < start:
+                continue
+            if seg_start > end:
+                break
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_end) - seg_start + 1
+            if kind == "data":
+                if lo == 0 and hi == seg_len:
+                    # 完整读取：边传边算 CRC（按列出时的大小截断，防止文件中途被追加）
+                    crc = 0
+                    async for chunk in self._read(i, 0, seg_len):
+                        crc = zlib.crc32(chunk, crc)
+                        yield chunk
+                    self._crc[i] = crc
+                else:
+                    async for chunk in self._read(i, lo, hi - lo):
+                        yield chunk
+                continue
+            if kind == "header":
+                data = self._local_header(i)
+            elif kind == "descriptor":
+                await self._ensure_crc(i)
+                data = self._descriptor(i)
+            elif kind == "central":
+                for j in range(len(self.entries)):
+                    await self._ensure_crc(j)
+                data = b"".join(self._central_header(j) for j in range(len(self.entries)))
+            else:
+                data = self._end()
+            yield data[lo:hi]
@@ -0,0 +1,19 @@
+# backend/utils/image_compression.py
+import io
+
+from PIL import Image, ImageOps
+
+
+def make_thumbnail(data: bytes, max_size: int = 400, quality: int = 80) -> bytes:
+    """
+    生成 JPEG 缩略图：按 EXIF 方向摆正，长边缩放到 max_size 以内。
+    纯函数，可在进程池中执行。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_size, max_size))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue()
@@ -25,6 +25,21 @@ interface RawRecordData {
   batchCode: string
   locked: boolean
   lockedAt?: string // ISO 格式的时间字符串
+  images?: ImageManifest // include_images=true 时后端附带
+  upNext?: UpNextRecord | null // prefetch=true 时后端软预留的下一条
+}
+
+interface ImageManifest {
+  base: string
+  files: string[] // 已按后缀数字排序
+}
+
+interface UpNextRecord {
+  _id: string
+  session: string
+  label: string
+  number: string
+  images: ImageManifest
 }
 
 interface RecordFormData {
@@ -578,7 +593,7 @@ export default function RecordForm() {
     setTemplateBuyerNotice('')
     setCustomBuyerNotice('')
     
-    const res = await fetch(`${RECORD_API}/next?session=${selectedSession}&user=${username}`)
+    const res = await fetch(`${RECORD_API}/next?session=${selectedSession}&user=${username}&include_images=true&prefetch=true`)
     if (res.status === 404) {
       const stat = await fetch(`${RECORD_API}/status?session=${selectedSession}`).then(r => r.json())
       if (stat.locked > 0 && stat.total - stat.locked === 0) {
@@ -630,14 +645,27 @@ export default function RecordForm() {
       setLocation(raw.location)
       setPrice(0)
 
-      // 拉取图片列表 统一用 cache-busting fetch image list，和 fetchImages 保持一致逻辑
-      const imgRes = await fetch(`${RECORD_API}/images/${raw.session}/${raw.number}`)
-      const files: string[] = imgRes.ok ? await imgRes.json() : []
+      // 图片列表随 /next 一起返回（已按后缀数字排序），旧后端未返回时再单独拉取
+      let files: string[]
+      if (raw.images) {
+        files = raw.images.files
+      } else {
+        const imgRes = await fetch(`${RECORD_API}/images/${raw.session}/${raw.number}`)
+        files = imgRes.ok ? await imgRes.json() : []
+      }
       const base = `${IMAGE_API}/${raw.session}/${raw.number}`
-      const now = Date.now()
       // 按后缀数字排序（-1, -2, -3...）
       const sortedFiles = files.slice().sort((a, b) => extractSuffixNum(a) - extractSuffixNum(b));
-      const urls = sortedFiles.map(f => `${base}/${f}?t=${now}`); // MOD: 加 ?t= 防缓存
+      // 首次加载用记录 ID 作为 ?t=（每条记录不同，但可命中下面的预加载缓存）；上传/删除后 fetchImages 仍用时间戳
+      const urls = sortedFiles.map(f => `${base}/${f}?t=${raw._id}`);
+      // 预加载下一条记录的图片
+      if (raw.upNext) {
+        const nextBase = `${IMAGE_API}/${raw.upNext.session}/${raw.upNext.number}`
+        raw.upNext.images.files.forEach(f => {
+          const img = new Image()
+          img.src = `${nextBase}/${f}?t=${raw.upNext!._id}`
+        })
+      }
       // 更新 state
       setData({
         raw,